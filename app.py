@@ -8,50 +8,18 @@ st.set_page_config(
 )
 import pandas as pd
 from scraper import Scraper
+from jobs import JobManager, JOB_MODE_IDS, JOB_MODE_DETAILS
 from database import Database
 import pandas as pd
-from config import SIZES, QUANTITIES
+from config import SIZES, QUANTITIES, DETAIL_WORKERS, DETAIL_MAX_AGE_HOURS
 import logging
 import os
-from datetime import datetime, timezone
+from datetime import datetime
 import time
-import pytz
-from io import StringIO
+from log_config import setup_logging, get_recent_logs
 
-# JSTタイムゾーンの設定
-jst = pytz.timezone('Asia/Tokyo')
-
-# ログをキャプチャするためのストリーム
-log_stream = StringIO()
-
-# ログのフォーマッターをカスタマイズ
-class JSTFormatter(logging.Formatter):
-    def converter(self, timestamp):
-        dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-        return dt.astimezone(jst)
-    
-    def formatTime(self, record, datefmt=None):
-        dt = self.converter(record.created)
-        if datefmt:
-            return dt.strftime(datefmt)
-        return dt.strftime('%Y-%m-%d %H:%M:%S %Z')
-
-# ログの設定
-log_formatter = JSTFormatter('%(asctime)s - %(levelname)s - %(message)s')
-
-# ファイルハンドラ
-file_handler = logging.FileHandler(f'data/logs/{datetime.now().strftime("%Y%m%d")}.log', mode='a', encoding='utf-8')
-file_handler.setFormatter(log_formatter)
-
-# ストリームハンドラ（Streamlit用）
-stream_handler = logging.StreamHandler(log_stream)
-stream_handler.setFormatter(log_formatter)
-
-# ロガーの設定
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+# ログの設定（ファイル書き込みはバックグラウンドで行い、画面には直近のログだけを表示する）
+setup_logging()
 
 # タイトル
 st.title("アースワンスクレイピングアプリ")
@@ -63,7 +31,7 @@ log_container = st.sidebar.empty()
 # ログを更新する関数
 def update_log_display():
     current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_container.text_area("ログ", value=log_stream.getvalue(), height=300, key=f"log_display_{current_time}")
+    log_container.text_area("ログ", value=get_recent_logs(), height=300, key=f"log_display_{current_time}")
 
 # スクレイパーの初期化
 @st.cache_resource
@@ -72,6 +40,15 @@ def init_scraper():
 
 scraper = init_scraper()
 
+# クロールジョブの実行スレッドを起動（再実行やリロードでは止まらない）
+@st.cache_resource
+def init_job_manager():
+    job_manager = JobManager()
+    job_manager.start()
+    return job_manager
+
+job_manager = init_job_manager()
+
 # データベースの初期化
 db = Database()
 
@@ -81,9 +58,15 @@ st.header("データベースの内容")
 # データベースリセットボタン
 if st.button("データベースをリセット"):
     try:
-        db_path = 'data/database.db'
+        db_path = db.db_path
         if os.path.exists(db_path):
-            os.remove(db_path)
+            db.close()
+            # WALモードの付随ファイルも合わせて削除
+            for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+            # キャッシュ済みの商品テーブルも破棄
+            st.cache_data.clear()
             st.success("データベースをリセットしました。ページをリロードしてください。")
             st.experimental_rerun()
         else:
@@ -92,15 +75,9 @@ if st.button("データベースをリセット"):
         st.error(f"データベースのリセット中にエラーが発生しました: {str(e)}")
         logging.error(f"データベースのリセット中にエラーが発生: {str(e)}")
 
-# 商品IDテーブルの表示
-# productsテーブルの表示
-st.subheader("商品テーブル")
-products = db.get_all_product_ids()
-if products:
-    # SQLite3のRowオブジェクトを辞書のリストに変換
-    products_list = [dict(row) for row in products]
-    products_df = pd.DataFrame(products_list)
-    
+# 表示用のDataFrameに変換（カラムの並び替えと日本語名への変更）
+def to_display_df(products_df):
+    """商品データのDataFrameを表示用に変換"""
     # カラムの順序を指定（必要に応じて調整）
     columns_order = [
         'id', 'product_id', 'name', 'size', 'url',
@@ -151,38 +128,90 @@ if products:
     # カラム名を日本語に変更
     products_df = products_df.rename(columns=column_names)
     
-    # DataFrameでの時刻表示をフォーマット
-    def format_datetime(dt):
-        if pd.isna(dt):
-            return ''
-        return pd.to_datetime(dt).tz_localize('UTC').tz_convert('Asia/Tokyo').strftime('%Y-%m-%d %H:%M:%S')
-
-    # DataFrameの日時カラムにフォーマットを適用
-    if 'created_at' in products_df.columns:
-        products_df['作成日時'] = products_df['created_at'].apply(format_datetime)
-    if 'updated_at' in products_df.columns:
-        products_df['更新日時'] = products_df['updated_at'].apply(format_datetime)
-    
-    # サイズごとの絞り込み機能
-    st.write("サイズごとの絞り込み")
-    selected_size = st.selectbox(
-        "絞り込みたいサイズを選択",
-        options=[""] + sorted(products_df['サイズ'].unique().tolist()),
-        index=0
-    )
+    # 日時はJSTに変換済みのため、タイムゾーン表記を外して表示
+    for col in ('作成日時', '更新日時'):
+        if col in products_df.columns:
+            products_df[col] = products_df[col].dt.tz_localize(None)
     
-    if st.button("サイズで絞り込む"):
-        if selected_size:
-            filtered_df = products_df[products_df['サイズ'] == selected_size]
-            st.dataframe(filtered_df)
-            st.write(f"{selected_size}サイズの商品数: {len(filtered_df)}件")
-        else:
-            # サイズが空の場合は全サイズ表示
-            st.dataframe(products_df)
-            st.write(f"全サイズの商品数: {len(products_df)}件")
-    else:
-        # デフォルトで全サイズ表示
-        st.dataframe(products_df)
+    return products_df
+
+def filters_from_key(filters_key):
+    """キャッシュキー用のタプルから絞り込み条件（dict）に戻す"""
+    filters = dict(filters_key)
+    filters['dimensions'] = dict(filters.get('dimensions', ()))
+    return filters
+
+# 絞り込み結果の件数と1ページ分を読み込み（データが変更された時だけ再読み込み）
+@st.cache_data(show_spinner=False, max_entries=32)
+def count_products(data_version, filters_key):
+    """絞り込み条件に一致する商品数を取得"""
+    return db.count_products(filters_from_key(filters_key))
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def load_products_page(data_version, filters_key, page, page_size):
+    """絞り込み条件に一致する商品のうち、指定ページのDataFrameを取得"""
+    products_df = db.load_products_dataframe(filters_from_key(filters_key), limit=page_size, offset=(page - 1) * page_size)
+    return to_display_df(products_df) if not products_df.empty else products_df
+
+# 商品IDテーブルの表示
+# productsテーブルの表示
+st.subheader("商品テーブル")
+dimension_labels = {
+    'outer_dimension_sum': '外形三辺合計',
+    'inner_length': '内寸_長さ',
+    'inner_width': '内寸_幅',
+    'inner_depth': '内寸_深さ',
+    'outer_length': '外寸_長さ',
+    'outer_width': '外寸_幅',
+    'outer_depth': '外寸_深さ',
+}
+with st.expander("絞り込み条件", expanded=False):
+    filter_cols = st.columns(2)
+    with filter_cols[0]:
+        filter_size = st.selectbox("サイズ", options=[""] + db.get_sizes(), index=0)
+        filter_text = st.text_input("商品ID・商品名（部分一致）")
+        filter_dates = st.date_input("作成日の範囲", value=(), format="YYYY-MM-DD")
+    with filter_cols[1]:
+        dimension_columns = {label: col for col, label in dimension_labels.items()}
+        filter_dimension_label = st.selectbox("寸法で絞り込む", options=["指定なし"] + list(dimension_columns))
+        filter_dimension = dimension_columns.get(filter_dimension_label)
+        dimension_min = st.number_input("最小値", min_value=0.0, value=0.0, step=10.0, disabled=not filter_dimension)
+        dimension_max = st.number_input("最大値（0は上限なし）", min_value=0.0, value=0.0, step=10.0, disabled=not filter_dimension)
+
+filters = {}
+if filter_size:
+    filters['size'] = filter_size
+if filter_text.strip():
+    filters['text'] = filter_text.strip()
+if filter_dimension and (dimension_min or dimension_max):
+    filters['dimensions'] = ((filter_dimension, (dimension_min or None, dimension_max or None)),)
+if len(filter_dates) >= 1:
+    filters['created_from'] = filter_dates[0].isoformat()
+if len(filter_dates) == 2:
+    filters['created_to'] = filter_dates[1].isoformat()
+filters_key = tuple(sorted(filters.items()))
+
+data_version = db.get_data_version()
+total_products = count_products(data_version, filters_key)
+
+page_cols = st.columns(2)
+with page_cols[0]:
+    page_size = st.selectbox("1ページの表示件数", options=[25, 50, 100, 200], index=1)
+total_pages = max(1, -(-total_products // page_size))
+# 絞り込みで総ページ数が減った場合は先頭ページに戻す
+if st.session_state.get('products_page', 1) > total_pages:
+    st.session_state['products_page'] = 1
+with page_cols[1]:
+    page = st.number_input("ページ", min_value=1, max_value=total_pages, step=1, key='products_page')
+
+products_df = load_products_page(data_version, filters_key, int(page), page_size)
+if total_products:
+    start = (int(page) - 1) * page_size + 1
+    end = min(int(page) * page_size, total_products)
+    st.dataframe(products_df)
+    st.write(f"商品数: {total_products}件（{start}〜{end}件目を表示、全 {total_pages} ページ）")
+elif filters:
+    st.info("条件に一致する商品はありません")
 else:
     st.info("商品テーブルは空です")
 
@@ -201,114 +230,52 @@ if not selected_size:
     st.warning("サイズを選択してください。")
 else:
     if st.button("①選択したサイズの商品ID、商品名、URLを取得"):
-        with st.spinner("商品IDを取得中..."):
-            try:
-                product_ids = scraper.get_product_ids([selected_size])
-                if product_ids:
-                    st.success(f"{len(product_ids)}件の商品IDを取得しました。")
-                    
-                    # 商品IDの表示
-                    st.subheader("取得した商品ID")
-                    df = pd.DataFrame([
-                        {"商品ID": p['id'], "商品名": p['name'], "サイズ": selected_size}
-                        for p in product_ids
-                    ])
-                    st.dataframe(df)
-                else:
-                    st.error("商品IDの取得に失敗しました。")
-            except Exception as e:
-                st.error(f"エラーが発生しました: {str(e)}")
-                logging.error(f"商品ID取得中にエラーが発生: {str(e)}", exc_info=True)
-            finally:
-                update_log_display()
+        try:
+            job_id = job_manager.submit(JOB_MODE_IDS, size=selected_size)
+            st.success(f"ジョブ {job_id} を登録しました。進捗は「クロールジョブ」で確認できます。")
+        except Exception as e:
+            st.error(f"エラーが発生しました: {str(e)}")
+            logging.error(f"商品ID取得ジョブの登録中にエラーが発生: {str(e)}", exc_info=True)
+        finally:
+            update_log_display()
 
     # 商品詳細取得
     st.header("②-1 商品詳細取得(複数商品)")
     # データベースから選択したサイズの商品IDを取得
     stored_products = db.get_product_ids(selected_size)
     if stored_products:
+        # 並列ワーカー数の設定
+        detail_workers = st.number_input(
+            "並列ワーカー数（同時に起動するブラウザ数）",
+            min_value=1,
+            max_value=16,
+            value=DETAIL_WORKERS,
+            step=1
+        )
+        # 差分取得（未取得・古い商品のみ）の設定
+        incremental = st.checkbox("未取得・古い商品のみ取得（差分取得）", value=True)
+        max_age_hours = st.number_input(
+            "再取得するまでの時間（時間）",
+            min_value=0.0,
+            value=DETAIL_MAX_AGE_HOURS,
+            step=1.0,
+            disabled=not incremental
+        )
         if st.button("②選択したサイズの商品詳細を一括取得"):
-            with st.spinner("商品詳細を取得中..."):
-                try:
-                    # 進捗バーの設定
-                    progress_bar = st.progress(0)
-                    total_products = len(stored_products)
-                    status_text = st.empty()
-                    
-                    # 失敗した商品IDを記録するリスト
-                    failed_products = []
-                    
-                    # 商品詳細の取得
-                    all_data = []
-                    for i, product in enumerate(stored_products, 1):
-                        try:
-                            # 進捗状況の更新
-                            progress = i / total_products
-                            progress_bar.progress(progress)
-                            status_text.text(f"処理中: {i}/{total_products} 件目 ({(progress*100):.1f}%)")
-                            
-                            # 商品IDの存在確認
-                            if not isinstance(product, dict):
-                                logging.error(f"不正な商品データ形式: {product}")
-                                failed_products.append({"id": str(product), "reason": "不正な商品データ形式"})
-                                continue
-                                
-                            product_id = product.get('product_id')
-                            if not product_id:
-                                logging.error(f"商品IDが存在しません: {product}")
-                                failed_products.append({"id": str(product), "reason": "商品IDが存在しません"})
-                                continue
-                                
-                            # 商品IDの形式確認
-                            if not isinstance(product_id, (str, int)):
-                                logging.error(f"不正な商品ID形式: {product_id}")
-                                failed_products.append({"id": str(product_id), "reason": "不正な商品ID形式"})
-                                continue
-                                
-                            # 商品IDを文字列に変換
-                            product_id = str(product_id)
-                            
-                            # 商品詳細の取得
-                            data = scraper.get_product_details([product_id])
-                            if data:
-                                all_data.append(data)
-                                logging.info(f"商品 {i}/{len(stored_products)} の詳細を取得しました: {product_id}")
-                            else:
-                                logging.warning(f"商品 {i}/{len(stored_products)} の詳細を取得できませんでした: {product_id}")
-                                failed_products.append({"id": product_id, "reason": "商品詳細の取得に失敗"})
-                                
-                        except Exception as e:
-                            logging.error(f"商品 {i}/{len(stored_products)} の処理中にエラー: {str(e)}")
-                            failed_products.append({"id": str(product.get('product_id', '不明')), "reason": str(e)})
-                            continue
-                    
-                    if all_data:
-                        st.success(f"{len(all_data)}件の商品詳細を取得しました。")
-                        
-                        # 商品詳細の表示
-                        st.subheader("取得した商品詳細")
-                        df = pd.DataFrame(all_data)
-                        st.dataframe(df)
-                        
-                        # 失敗した商品の表示
-                        if failed_products:
-                            st.warning(f"{len(failed_products)}件の商品の取得に失敗しました。")
-                            st.subheader("失敗した商品一覧")
-                            failed_df = pd.DataFrame(failed_products)
-                            st.dataframe(failed_df)
-                    else:
-                        st.error("商品詳細の取得に失敗しました。")
-                        if failed_products:
-                            st.subheader("失敗した商品一覧")
-                            failed_df = pd.DataFrame(failed_products)
-                            st.dataframe(failed_df)
-                except Exception as e:
-                    st.error(f"エラーが発生しました: {str(e)}")
-                    logging.error(f"商品詳細取得中にエラーが発生: {str(e)}", exc_info=True)
-                finally:
-                    update_log_display()
-                    progress_bar.empty()
-                    status_text.empty()
+            try:
+                if incremental:
+                    # 対象は実行時に決めるため、中断後の再実行では残りの商品から再開される
+                    job_id = job_manager.submit(JOB_MODE_DETAILS, size=selected_size, workers=int(detail_workers), max_age_hours=max_age_hours)
+                    st.success(f"ジョブ {job_id} を登録しました（差分取得）。進捗は「クロールジョブ」で確認できます。")
+                else:
+                    target_ids = [str(product['product_id']) for product in stored_products if product.get('product_id')]
+                    job_id = job_manager.submit(JOB_MODE_DETAILS, size=selected_size, product_ids=target_ids, workers=int(detail_workers))
+                    st.success(f"ジョブ {job_id} を登録しました（{len(target_ids)}件）。進捗は「クロールジョブ」で確認できます。")
+            except Exception as e:
+                st.error(f"エラーが発生しました: {str(e)}")
+                logging.error(f"商品詳細取得ジョブの登録中にエラーが発生: {str(e)}", exc_info=True)
+            finally:
+                update_log_display()
     else:
         st.warning(f"{selected_size}のサイズの商品IDがデータベースに存在しません。")
 
@@ -383,5 +350,90 @@ else:
     else:
         st.warning(f"{selected_size}のサイズの商品がデータベースに存在しません。")
 
+# クロールジョブの状態（データベースに記録された進捗を表示するだけで、処理は待たない）
+st.header("クロールジョブ")
+job_status_labels = {'queued': '待機中', 'running': '実行中', 'completed': '完了', 'failed': '失敗'}
+job_mode_labels = {JOB_MODE_IDS: '商品ID取得', JOB_MODE_DETAILS: '商品詳細取得'}
+st.button("ジョブの状態を更新")
+jobs = db.get_jobs(limit=10)
+if jobs:
+    for job in jobs:
+        label = (
+            f"ジョブ {job['id']}: {job_mode_labels.get(job['mode'], job['mode'])} / {job['size'] or '-'}"
+            f" / {job_status_labels.get(job['status'], job['status'])}"
+        )
+        if job['total']:
+            st.progress(min(job['done'] / job['total'], 1.0), text=f"{label}（{job['done']}/{job['total']}件, 失敗 {job['failed']}件）")
+        else:
+            st.write(label)
+        if job['error']:
+            st.error(f"ジョブ {job['id']} のエラー: {job['error']}")
+        if job['failures']:
+            with st.expander(f"ジョブ {job['id']} の失敗した商品一覧（{len(job['failures'])}件）"):
+                st.dataframe(pd.DataFrame(job['failures']))
+else:
+    st.info("登録されたジョブはありません")
+
+# 商品詳細取得の処理段階ごとの所要時間
+st.header("処理時間の内訳")
+stage_labels = {
+    'total': '合計',
+    'rate_limit_wait': 'リクエスト制御の待機',
+    'http_fetch': 'HTTP取得',
+    'driver_get': 'ページ遷移 (driver.get)',
+    'wait_ready': '準備完了待ち (WebDriverWait)',
+    'unit_switch': '単位タブの切り替え',
+    'wait_floor': '最低待機時間',
+    'page_source': 'HTML取得 (page_source)',
+    'snapshot_regions': 'HTML取得 (必要領域のみ)',
+    'cache_store': 'ページキャッシュの保存',
+    'parse_html': 'HTML解析 (BeautifulSoup)',
+    'extract': '項目の抽出',
+    'db_lookup': 'データベース参照',
+    'db_save': 'データベース保存',
+}
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_stage_timings(data_version, since_hours):
+    """段階ごとのp50/p95と、時間のかかった商品の一覧を集計"""
+    spans_df = db.load_trace_spans(since_hours)
+    if spans_df.empty:
+        return spans_df, spans_df
+    spans_df['duration_ms'] = spans_df['duration'] * 1000
+    
+    grouped = spans_df.groupby('stage')['duration_ms']
+    summary_df = pd.DataFrame({
+        '回数': grouped.count(),
+        'p50(ms)': grouped.quantile(0.5),
+        'p95(ms)': grouped.quantile(0.95),
+        '平均(ms)': grouped.mean(),
+        '合計(秒)': grouped.sum() / 1000,
+    }).sort_values('合計(秒)', ascending=False).round(1)
+    summary_df.index = [stage_labels.get(stage, stage) for stage in summary_df.index]
+    
+    # 合計時間の長い商品と、その段階ごとの内訳
+    totals = spans_df[spans_df['stage'] == 'total'].nlargest(10, 'duration_ms')
+    slowest_df = (
+        spans_df[spans_df['trace_id'].isin(totals['trace_id'])]
+        .pivot_table(index=['trace_id', 'product_id'], columns='stage', values='duration_ms', aggfunc='sum')
+        .sort_values('total', ascending=False)
+        .round(0)
+        .reset_index(level='product_id')
+        .rename(columns={'product_id': '商品ID', **stage_labels})
+        .rename_axis(columns=None)
+    )
+    return summary_df, slowest_df.reset_index(drop=True)
+
+trace_periods = {"直近1時間": 1, "直近24時間": 24, "直近7日間": 24 * 7}
+trace_period = st.selectbox("集計期間", options=list(trace_periods), index=1)
+stage_summary_df, slowest_products_df = load_stage_timings(db.get_data_version(), trace_periods[trace_period])
+if stage_summary_df.empty:
+    st.info("処理時間の記録はありません")
+else:
+    st.subheader("段階ごとの所要時間")
+    st.dataframe(stage_summary_df)
+    st.subheader("時間のかかった商品（上位10件, ms）")
+    st.dataframe(slowest_products_df)
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""productsテーブルのインデックス有無によるクエリ時間のベンチマーク
+
+一時ディレクトリのSQLiteに商品を投入し、インデックスを外した状態と
+作成した状態で同じクエリを実行して1回あたりの時間を比較する。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.bench_db_indexes [--rows 100000] [--lookups 1000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from config import SIZES
+from database import Database, PRODUCT_INDEXES
+
+
+def populate(db, rows):
+    """サイズごとに商品IDを投入し、作成日時をばらつかせる"""
+    per_size = rows // len(SIZES)
+    product_ids = []
+    for size_index, size in enumerate(SIZES):
+        products = []
+        for i in range(per_size):
+            product_id = f"{size_index:02d}{i:07d}"
+            products.append({'id': product_id, 'name': f"ダンボール {product_id}", 'url': f"https://example.com/{product_id}.html"})
+            product_ids.append(product_id)
+        db.save_product_ids(products, size)
+
+    conn = db._get_connection()
+    conn.execute("UPDATE products SET created_at = datetime('2024-01-01', '+' || (abs(random()) % 31536000) || ' seconds')")
+    conn.commit()
+    return product_ids
+
+
+def measure(label, func, repeat):
+    """1回あたりの平均実行時間（ミリ秒）を計測"""
+    func()  # ウォームアップ
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return label, (time.perf_counter() - started) * 1000 / repeat
+
+
+def run_queries(db, product_ids, lookups):
+    """対象クエリを実行して計測結果を返す"""
+    conn = db._get_connection()
+    size = SIZES[0]
+    sample_ids = random.sample(product_ids, min(lookups, len(product_ids)))
+
+    def fetch(sql, params=()):
+        return lambda: conn.execute(sql, params).fetchall()
+
+    def lookup_all(method):
+        return lambda: [method(product_id) for product_id in sample_ids]
+
+    by_size = "SELECT product_id, name, size, created_at FROM products WHERE size = ? ORDER BY created_at DESC"
+    latest = "SELECT product_id, name, size, created_at FROM products ORDER BY created_at DESC"
+    return [
+        measure('サイズ別・作成日時順（全件）', fetch(by_size, (size,)), 10),
+        measure('サイズ別・作成日時順（先頭50件）', fetch(by_size + " LIMIT 50", (size,)), 50),
+        measure('サイズ別件数', fetch("SELECT COUNT(*) FROM products WHERE size = ?", (size,)), 50),
+        measure('全商品・作成日時順（先頭50件）', fetch(latest + " LIMIT 50"), 50),
+        measure('get_product_ids(size)', lambda: db.get_product_ids(size), 5),
+        measure(f'get_size_type x{len(sample_ids)}', lookup_all(db.get_size_type), 3),
+        measure(f'get_url_by_product_id x{len(sample_ids)}', lookup_all(db.get_url_by_product_id), 3),
+    ]
+
+
+def query_plans(db):
+    """主要クエリの実行計画を取得"""
+    conn = db._get_connection()
+    queries = {
+        'get_product_ids(size)': ("SELECT product_id, name, size, created_at FROM products WHERE size = ? ORDER BY created_at DESC", (SIZES[0],)),
+        'get_product_ids(None)': ("SELECT product_id, name, size, created_at FROM products ORDER BY created_at DESC", ()),
+        'get_url_by_product_id': ("SELECT url FROM products WHERE product_id = ?", ('000000001',)),
+        'get_size_type': ("SELECT size FROM products WHERE product_id = ?", ('000000001',)),
+    }
+    return {
+        label: ' / '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+        for label, (sql, params) in queries.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='インデックス有無によるクエリ時間のベンチマーク')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, 'bench.db'))
+        product_ids = populate(db, args.rows)
+        conn = db._get_connection()
+        print(f"投入件数: {len(product_ids)} 件")
+
+        for name in PRODUCT_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.commit()
+        before = run_queries(db, product_ids, args.lookups)
+
+        db._create_indexes(conn)
+        after = run_queries(db, product_ids, args.lookups)
+
+        print(f"{'クエリ':<36}{'インデックスなし(ms)':>20}{'インデックスあり(ms)':>20}")
+        for (label, before_ms), (_, after_ms) in zip(before, after):
+            print(f"{label:<36}{before_ms:>20.2f}{after_ms:>20.2f}")
+
+        print("\n実行計画（インデックスあり）")
+        for label, plan in query_plans(db).items():
+            print(f"  {label}: {plan}")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""HTML解析のベンチマーク（全体解析 vs 必要領域のみの解析）
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.bench_parsing [--iterations 50]
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+from page_parser import PARSER_BACKEND, parse_listing_page, parse_detail_page
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    """フィクスチャHTMLを読み込む"""
+    with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def parse_full(html):
+    """変更前の解析方法（ページ全体をhtml.parserで解析）"""
+    return BeautifulSoup(html, 'html.parser')
+
+
+def measure(parse, html, iterations):
+    """1ページあたりの解析時間（ミリ秒）とピークメモリ（KB）を計測"""
+    parse(html)  # ウォームアップ
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        parse(html)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / iterations
+
+    tracemalloc.start()
+    soup = parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del soup
+    return elapsed_ms, peak / 1024
+
+
+def check_regions(page, soup):
+    """必要な要素が解析結果に含まれているか確認"""
+    if page == 'category':
+        return bool(soup.find('div', id='resultBox')) and bool(soup.find('li', class_='next_page'))
+    return all([
+        soup.find('div', id='detailsBox'),
+        soup.find('li', id='small_price1'),
+        soup.find('li', id='big_price1'),
+    ])
+
+
+def run(iterations):
+    """ベンチマークを実行して結果のリストを返す"""
+    cases = [
+        ('category', load_fixture('category_page.html'), parse_listing_page),
+        ('detail', load_fixture('detail_page.html'), parse_detail_page),
+    ]
+    results = []
+    for page, html, parse_region in cases:
+        before_ms, before_kb = measure(parse_full, html, iterations)
+        after_ms, after_kb = measure(parse_region, html, iterations)
+        results.append({
+            'page': page,
+            'html_kb': len(html.encode('utf-8')) / 1024,
+            'before_ms': before_ms,
+            'after_ms': after_ms,
+            'before_peak_kb': before_kb,
+            'after_peak_kb': after_kb,
+            'regions_ok': check_regions(page, parse_region(html)),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTML解析のベンチマーク')
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"パーサー: html.parser（全体） → {PARSER_BACKEND}（必要領域のみ）")
+    print(f"{'ページ':<10}{'HTML(KB)':>10}{'変更前(ms)':>12}{'変更後(ms)':>12}{'変更前(KB)':>12}{'変更後(KB)':>12}  要素確認")
+    for r in run(args.iterations):
+        print(
+            f"{r['page']:<10}{r['html_kb']:>10.1f}{r['before_ms']:>12.2f}{r['after_ms']:>12.2f}"
+            f"{r['before_peak_kb']:>12.0f}{r['after_peak_kb']:>12.0f}  {'OK' if r['regions_ok'] else 'NG'}"
+        )
+
+
+if __name__ == '__main__':
+    main()
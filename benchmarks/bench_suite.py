@@ -0,0 +1,164 @@
+"""解析と保存のホットパスのベンチマーク（結果をJSONで出力）
+
+フィクスチャHTMLを使い、ネットワークやブラウザを使わずに以下を計測する。
+    - カテゴリページの解析（get_product_ids と同じ処理、pages/sec）
+    - 詳細ページの解析（get_product_detail と同じ処理、records/sec）
+    - Database.save_product（新規・変更なし・価格変更、rows/sec）
+    - Database.save_product_ids（新規・更新、rows/sec）
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.bench_suite [--iterations 50] [--rows 500] [--output results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from database import Database
+from page_parser import (
+    PARSER_BACKEND, parse_listing_page, parse_detail_page, parse_listing_products, extract_product_data,
+    get_last_page_number
+)
+from benchmarks.bench_parsing import load_fixture
+
+
+def rate(label, unit, count, func):
+    """func() を実行し、1秒あたりの処理件数を計測"""
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    return {
+        'name': label,
+        'unit': unit,
+        'count': count,
+        'seconds': round(elapsed, 6),
+        'per_second': round(count / elapsed, 2) if elapsed else None,
+    }
+
+
+def bench_listing(html, iterations):
+    """カテゴリページの解析（商品一覧とページ数の取得）"""
+    parse_listing_products(parse_listing_page(html))  # ウォームアップ
+
+    def run():
+        for _ in range(iterations):
+            soup = parse_listing_page(html)
+            parse_listing_products(soup)
+            get_last_page_number(soup)
+
+    result = rate('listing_parse', 'pages', iterations, run)
+    result['products_per_page'] = len(parse_listing_products(parse_listing_page(html)))
+    return result
+
+
+def bench_detail(html, iterations):
+    """詳細ページの解析（1枚単位・10枚単位の2ページから1商品のデータを作成）"""
+    def parse_one(i):
+        return extract_product_data(f"B{i:07d}", f"https://example.com/{i}.html", 'size-60',
+                                    parse_detail_page(html), parse_detail_page(html))
+
+    sample = parse_one(0)  # ウォームアップ
+    result = rate('detail_parse', 'records', iterations, lambda: [parse_one(i) for i in range(iterations)])
+    result['prices_per_record'] = sum(1 for key in sample if key.endswith('枚の価格'))
+    return result, sample
+
+
+def bench_save_product(db, sample, rows):
+    """save_productを新規保存・変更なし・価格変更の3通りで計測"""
+    records = [dict(sample, 商品コード=f"B{i:07d}", url=f"https://example.com/{i}.html") for i in range(rows)]
+    changed = []
+    for record in records:
+        record = dict(record)
+        record['10枚の価格'] = (record.get('10枚の価格') or 0) + 1
+        changed.append(record)
+
+    def save_all(items):
+        return lambda: [db.save_product(record) for record in items]
+
+    return [
+        rate('save_product_insert', 'rows', rows, save_all(records)),
+        rate('save_product_unchanged', 'rows', rows, save_all(records)),
+        rate('save_product_price_changed', 'rows', rows, save_all(changed)),
+    ]
+
+
+def bench_save_product_ids(db, rows):
+    """save_product_idsを新規追加と更新の2通りで計測"""
+    products = [
+        {'id': f"C{i:07d}", 'name': f"ダンボール {i}", 'url': f"https://example.com/c/{i}.html"}
+        for i in range(rows)
+    ]
+    return [
+        rate('save_product_ids_insert', 'rows', rows, lambda: db.save_product_ids(products, 'size-60')),
+        rate('save_product_ids_update', 'rows', rows, lambda: db.save_product_ids(products, 'size-60')),
+    ]
+
+
+def git_revision():
+    """計測したコードのコミットID（取得できなければNone）"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(iterations, rows):
+    """ベンチマークを実行して結果（dict）を返す"""
+    category_html = load_fixture('category_page.html')
+    detail_html = load_fixture('detail_page.html')
+
+    results = [bench_listing(category_html, iterations)]
+    detail_result, sample = bench_detail(detail_html, iterations)
+    results.append(detail_result)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, 'bench.db'))
+        results.extend(bench_save_product(db, sample, rows))
+        results.extend(bench_save_product_ids(db, rows))
+        db.close()
+
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_revision': git_revision(),
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'parser': PARSER_BACKEND,
+            'platform': platform.platform(),
+        },
+        'parameters': {'iterations': iterations, 'rows': rows},
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='解析と保存のホットパスのベンチマーク')
+    parser.add_argument('--iterations', type=int, default=50, help='解析するページ数')
+    parser.add_argument('--rows', type=int, default=500, help='保存する行数')
+    parser.add_argument('--output', help='結果のJSONを書き込むファイル（省略時は標準出力）')
+    args = parser.parse_args()
+
+    # 1行ごとのログが計測結果に影響しないようにする
+    logging.disable(logging.INFO)
+    report = run(args.iterations, args.rows)
+    logging.disable(logging.NOTSET)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        for result in report['results']:
+            print(f"{result['name']:<30}{result['per_second']:>12.1f} {result['unit']}/sec")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
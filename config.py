@@ -1,3 +1,5 @@
+import os
+
 # サイズのリスト
 SIZES = [
     'size-60',
@@ -13,6 +15,89 @@ SIZES = [
 # 枚数のリスト
 QUANTITIES = [i for i in range(1, 10)] + [i for i in range(10, 4210, 10)]
 
+# データベースファイルのパス
+DB_PATH = os.environ.get('DB_PATH', 'data/database.db')
+
+# SQLite接続ごとに設定するPRAGMA
+# WALにより、スクレイピングの書き込み中でも画面側の読み込みが待たされない
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -20000)),  # 負の値はKiB単位（約20MB）
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 10000)),  # ミリ秒
+    'temp_store': 'MEMORY',
+}
+
+# 商品詳細を並列取得する際のワーカー（Chromeドライバー）数
+DETAIL_WORKERS = int(os.environ.get('DETAIL_WORKERS', 3))
+
+# カテゴリページの取得で並行処理するサイズ数と、1サイズあたりの並行取得ページ数
+CATEGORY_SIZE_WORKERS = int(os.environ.get('CATEGORY_SIZE_WORKERS', 4))
+CATEGORY_MAX_CONCURRENCY = int(os.environ.get('CATEGORY_MAX_CONCURRENCY', 4))
+
+# 対象サイトへのリクエスト制御（全ワーカー合計の秒間リクエスト数、瞬間的に許可する件数、ホストごとの同時接続数）
+REQUEST_RATE = float(os.environ.get('REQUEST_RATE', 1.0))
+REQUEST_BURST = int(os.environ.get('REQUEST_BURST', 2))
+PER_HOST_CONCURRENCY = int(os.environ.get('PER_HOST_CONCURRENCY', 4))
+
+# JavaScriptが不要なページをHTTP（requests.Session）で取得するかどうか
+USE_HTTP_FETCH = os.environ.get('USE_HTTP_FETCH', '1') == '1'
+
+# HTTP取得のタイムアウト（秒）とコネクションプールのサイズ
+HTTP_TIMEOUT = 15
+HTTP_POOL_SIZE = 10
+
+# HTTP取得の再試行回数と間隔（秒、試行ごとに倍）。再試行も1回ずつリクエスト制御の許可を取る
+HTTP_MAX_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Seleniumでのページ取得の再試行間隔（秒、試行ごとに倍）
+BROWSER_RETRY_BACKOFF = 2.0
+
+# HTTP取得時にProxyManagerのプロキシを経由するかどうか
+HTTP_USE_PROXY = os.environ.get('HTTP_USE_PROXY', '0') == '1'
+
+# Seleniumでのページ準備完了待ちの設定
+# 準備完了は #detailsBox / #resultBox や価格リストの状態変化で判定し、
+# PAGE_MIN_WAIT は読み込み開始からの最低待機時間（秒）として扱う
+PAGE_READY_SELECTOR = '#detailsBox, #resultBox'
+PAGE_READY_TIMEOUT = 15
+PAGE_MIN_WAIT = float(os.environ.get('PAGE_MIN_WAIT', 0.5))
+UNIT_SWITCH_TIMEOUT = 10
+WAIT_POLL_FREQUENCY = 0.1
+
+# 1回のページ遷移で単位タブを切り替えて1枚単位・10枚単位の価格をまとめて取得するかどうか
+SINGLE_SESSION_UNITS = os.environ.get('SINGLE_SESSION_UNITS', '1') == '1'
+
+# 従来の固定待機時間（秒）。短縮できた時間の計測に使用する
+LEGACY_PAGE_SLEEP = 3
+
+# 差分取得で商品詳細を再取得するまでの時間（最終取得からの経過時間）
+DETAIL_MAX_AGE_HOURS = float(os.environ.get('DETAIL_MAX_AGE_HOURS', 24))
+
+# バックグラウンドでクロールジョブを実行するスレッド数と、待機中ジョブの確認間隔（秒）
+JOB_RUNNERS = int(os.environ.get('JOB_RUNNERS', 2))
+JOB_POLL_INTERVAL = 2
+
+# 取得したページを圧縮して保存するキャッシュ（保存先、保持期間、最大容量）
+PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', '1') == '1'
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', 'data/page_cache')
+PAGE_CACHE_TTL_DAYS = float(os.environ.get('PAGE_CACHE_TTL_DAYS', 30))
+PAGE_CACHE_MAX_MB = float(os.environ.get('PAGE_CACHE_MAX_MB', 500))
+# キャッシュ済みのページだけを使い、ブラウザを起動せずに解析し直すかどうか
+PAGE_CACHE_REPLAY = os.environ.get('PAGE_CACHE_REPLAY', '0') == '1'
+
+# 商品ごとの処理段階の所要時間を記録するかどうかと、記録の保持期間（日）
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') == '1'
+TRACE_RETENTION_DAYS = 7
+
+# ログの出力先ディレクトリ、出力レベル、画面表示用に保持する直近のログの行数
+LOG_DIR = os.environ.get('LOG_DIR', 'data/logs')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_BUFFER_LINES = 500
+
 # プロキシ設定
 PROXY_CONFIGS = [
     {'host': '82.23.196.48', 'port': 6754, 'username': 'eephhnsv', 'password': 'o6ubqbfofs5z'},
@@ -42,6 +127,21 @@ PROXY_CONFIGS = [
     {'host': '130.180.255.178', 'port': 9869, 'username': 'eephhnsv', 'password': 'o6ubqbfofs5z'}
 ]
 
+# プロキシの動作確認に使うURL（ローカルのスタブなどに差し替え可能）とタイムアウト（秒）
+PROXY_CHECK_URL = os.environ.get('PROXY_CHECK_URL', 'http://httpbin.org/ip')
+PROXY_CHECK_TIMEOUT = float(os.environ.get('PROXY_CHECK_TIMEOUT', 10))
+# 動作確認を同時に行うプロキシ数
+PROXY_CHECK_WORKERS = int(os.environ.get('PROXY_CHECK_WORKERS', 10))
+# 応答時間・失敗率の指数移動平均の重み（大きいほど直近の結果を重視）
+PROXY_EWMA_ALPHA = 0.3
+
+# 連続してこの回数失敗したプロキシは PROXY_BREAKER_COOLDOWN 秒間使用しない
+PROXY_BREAKER_THRESHOLD = 3
+PROXY_BREAKER_COOLDOWN = 300
+
+# Seleniumのドライバーをプロキシ経由で起動するかどうか（利用できるプロキシがなければ直接接続）
+SELENIUM_USE_PROXY = os.environ.get('SELENIUM_USE_PROXY', '1') == '1'
+
 # リクエストヘッダーの設定
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -1,66 +1,157 @@
 import sqlite3
+import json
+import hashlib
 import pandas as pd
 import numpy as np
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timedelta
 import os
 import stat
 import logging
 import threading
-from config import QUANTITIES
+from functools import wraps
+from config import QUANTITIES, DB_PATH, SQLITE_PRAGMAS, DETAIL_MAX_AGE_HOURS, TRACE_RETENTION_DAYS
 import pytz
 
 # JSTタイムゾーンの設定
 jst = pytz.timezone('Asia/Tokyo')
 
-# ログディレクトリの作成
-log_dir = 'data/logs'
-os.makedirs(log_dir, exist_ok=True)
-
-# ログの設定
-file_handler = logging.FileHandler(f'{log_dir}/{datetime.now().strftime("%Y%m%d")}.log', mode='a', encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger = logging.getLogger()
-logger.addHandler(file_handler)
-logger.setLevel(logging.INFO)
-
-class JSTFormatter(logging.Formatter):
-    def converter(self, timestamp):
-        dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-        return dt.astimezone(jst)
-    
-    def formatTime(self, record, datefmt=None):
-        dt = self.converter(record.created)
-        if datefmt:
-            return dt.strftime(datefmt)
-        return dt.strftime('%Y-%m-%d %H:%M:%S %Z')
+# 日時はUTCで保存する。画面で指定された日付（JST）はこの差分でUTCに直して比較する
+JST_OFFSET_MODIFIER = '-9 hours'
+
+# 日時の保存形式のバージョン（PRAGMA user_version）
+# 1: productsのcreated_at/updated_atをUTCに統一
+SCHEMA_VERSION = 1
+
+# 1回のクエリで使用するバインド変数の上限（SQLiteの既定値999以内に収める）
+SQLITE_MAX_VARIABLES = 500
+
+# productsテーブルのカラム定義（価格はproduct_pricesテーブルに保存）
+PRODUCT_COLUMNS_SQL = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id TEXT UNIQUE,
+    name TEXT,
+    size TEXT,
+    url TEXT,
+    outer_dimension_sum REAL,
+    inner_length REAL,
+    inner_width REAL,
+    inner_depth REAL,
+    manufacturing_method TEXT,
+    outer_length REAL,
+    outer_width REAL,
+    outer_depth REAL,
+    processing_location TEXT,
+    color TEXT,
+    box_type TEXT,
+    thickness TEXT,
+    material TEXT,
+    standard_width REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    detail_checked_at TIMESTAMP,
+    content_hash TEXT
+"""
+
+# 既存のproductsテーブルに後から追加したカラム（カラム名 → 型）
+ADDED_PRODUCT_COLUMNS = {
+    # 商品詳細を最後に取得・保存した日時（差分取得のチェックポイント）
+    'detail_checked_at': 'TIMESTAMP',
+    # 取得した詳細と価格の内容から計算したハッシュ（変更がなければ書き込みを省略する）
+    'content_hash': 'TEXT',
+}
+
+# productsテーブルのインデックス（名前 → 定義）
+# get_url_by_product_id / get_size_type はproduct_idのUNIQUEインデックスで検索される
+PRODUCT_INDEXES = {
+    # get_product_ids(size) / get_products_by_size: サイズで絞り込み、作成日時の新しい順（カバリング）
+    'idx_products_size_created': '(size, created_at DESC, product_id, name)',
+    # get_product_ids(None): 全商品を作成日時の新しい順
+    'idx_products_created': '(created_at DESC)',
+    # get_products_needing_refresh: 詳細が未取得・古い商品の抽出
+    'idx_products_detail_checked': '(detail_checked_at)',
+}
+
+# 範囲で絞り込みできる寸法カラム
+DIMENSION_COLUMNS = (
+    'outer_dimension_sum',
+    'inner_length', 'inner_width', 'inner_depth',
+    'outer_length', 'outer_width', 'outer_depth',
+)
+
+# DataFrameでcategory型として扱うカラム（値の種類が少ないもの）
+CATEGORY_COLUMNS = ('size', 'material', 'color', 'box_type', 'manufacturing_method')
+
+def _normalize_value(value):
+    """比較・ハッシュ用に値を正規化（数値は小数に揃え、空文字はNoneにする）"""
+    if value is None or (isinstance(value, str) and value.strip() == ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+def compute_content_hash(details, price_data):
+    """商品詳細（カラム → 値）と価格（枚数 → 価格）から内容のハッシュを計算"""
+    normalized = {
+        'details': sorted((col, _normalize_value(val)) for col, val in details.items()),
+        'prices': sorted((int(q), _normalize_value(price)) for q, price in price_data.items()),
+    }
+    payload = json.dumps(normalized, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _serialized_write(method):
+    """書き込みメソッドをインスタンスの書き込みロックで直列化する"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 class Database:
-    _instance = None
+    _instances = {}
     _lock = threading.Lock()
     
-    def __new__(cls):
+    def __new__(cls, db_path=None, pragmas=None):
+        # データベースファイルごとに1インスタンス（pragmasは __init__ で使用）
+        db_path = db_path or DB_PATH
         with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(Database, cls).__new__(cls)
-                cls._instance._initialized = False
-            return cls._instance
+            if db_path not in cls._instances:
+                instance = super(Database, cls).__new__(cls)
+                instance._initialized = False
+                cls._instances[db_path] = instance
+            return cls._instances[db_path]
     
-    def __init__(self):
+    def __init__(self, db_path=None, pragmas=None):
+        """pragmas で SQLITE_PRAGMAS を上書きできる（同じパスで最初に作成したときだけ反映される）"""
         if self._initialized:
             return
             
         self._initialized = True
-        self.db_path = 'data/database.db'
+        self.db_path = db_path or DB_PATH
+        self.pragmas = {**SQLITE_PRAGMAS, **(pragmas or {})}
         self._ensure_directory_exists()
         self._thread_local = threading.local()
+        # SQLiteの書き込みは1本に直列化する（並列ワーカーからの同時書き込み対策）
+        self._write_lock = threading.RLock()
+        # データ変更検知専用の接続（書き込みを行わないため、全ての書き込みでdata_versionが変化する）
+        self._version_conn = None
+        self._version_lock = threading.Lock()
         self._create_tables()
     
     def _get_connection(self):
         if not hasattr(self._thread_local, 'conn'):
-            self._thread_local.conn = sqlite3.connect(self.db_path)
-            self._thread_local.conn.row_factory = sqlite3.Row
+            self._thread_local.conn = self._connect()
         return self._thread_local.conn
     
+    def _connect(self):
+        """PRAGMAを設定した接続を作成"""
+        busy_timeout = self.pragmas.get('busy_timeout', 5000)
+        conn = sqlite3.connect(self.db_path, timeout=busy_timeout / 1000)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+    
     def _ensure_directory_exists(self):
         """データベースディレクトリが存在することを確認"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
@@ -76,50 +167,214 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
-        
-            # 価格カラムの定義を生成
-            price_columns = []
-            for q in QUANTITIES:
-                price_columns.append(f'price_{q} INTEGER')
-            price_columns_str = ',\n'.join(price_columns)
             
-            # productsテーブルの作成
+            # productsテーブルの作成（価格はproduct_pricesテーブルに縦持ちで保存）
             cursor.execute(f"""
                 CREATE TABLE IF NOT EXISTS products (
+                    {PRODUCT_COLUMNS_SQL}
+                )
+            """)
+            
+            # 価格テーブルの作成（商品ID×枚数で1行）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS product_prices (
+                    product_id TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    price INTEGER,
+                    PRIMARY KEY (product_id, quantity)
+                ) WITHOUT ROWID
+            """)
+            # 「◯枚の価格を全商品で比較」のような検索用
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_product_prices_quantity
+                ON product_prices (quantity, price)
+            """)
+            
+            # クロールジョブのテーブル（状態と進捗を保存し、画面側はこれを参照する）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS crawl_jobs (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    product_id TEXT UNIQUE,
-                    name TEXT,
+                    mode TEXT NOT NULL,
                     size TEXT,
-                    url TEXT,
-                    outer_dimension_sum REAL,
-                    inner_length REAL,
-                    inner_width REAL,
-                    inner_depth REAL,
-                    manufacturing_method TEXT,
-                    outer_length REAL,
-                    outer_width REAL,
-                    outer_depth REAL,
-                    processing_location TEXT,
-                    color TEXT,
-                    box_type TEXT,
-                    thickness TEXT,
-                    material TEXT,
-                    standard_width REAL,
-                    {price_columns_str},
+                    product_ids TEXT,
+                    workers INTEGER DEFAULT 1,
+                    max_age_hours REAL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    total INTEGER DEFAULT 0,
+                    done INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    failures TEXT,
+                    error TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP
                 )
             """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_crawl_jobs_status
+                ON crawl_jobs (status, id)
+            """)
+            
+            # 取得したページのキャッシュの索引（本文は圧縮ファイルとして内容のハッシュ名で保存）
+            # unitは単位タブ（切り替えなしは0）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS page_cache (
+                    url TEXT NOT NULL,
+                    unit INTEGER NOT NULL DEFAULT 0,
+                    fetched_at TIMESTAMP NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    PRIMARY KEY (url, unit, fetched_at)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_page_cache_fetched
+                ON page_cache (fetched_at)
+            """)
             
+            # 商品ごとの処理段階（ページ遷移・待機・解析・保存など）の所要時間
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS trace_spans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    trace_id TEXT NOT NULL,
+                    product_id TEXT,
+                    stage TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_trace_spans_created
+                ON trace_spans (created_at)
+            """)
             conn.commit()
+            
+            # 旧形式（price_◯カラムを持つproductsテーブル）からの移行
+            self._migrate_wide_prices(conn)
+            self._add_missing_columns(conn)
+            self._migrate_jst_timestamps(conn)
+            
+            # 検索・並び替え用のインデックス（移行でテーブルを作り直した後に作成）
+            self._create_indexes(conn)
+            
+            # 従来の横持ち形式で参照するための互換ビュー
+            self._create_wide_view(conn)
+            
             logging.info("テーブルの作成が完了しました")
             
         except sqlite3.Error as e:
             logging.error(f"テーブル作成中にエラーが発生: {str(e)}")
             raise
+        finally:
+            if cursor:
+                cursor.close()
+
+    def _create_indexes(self, conn):
+        """productsテーブルの検索経路ごとのインデックスを作成"""
+        for name, definition in PRODUCT_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON products {definition}")
+        # 統計情報を更新してクエリプランナーに反映させる
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+
+    def _get_table_columns(self, conn, table_name):
+        """テーブルのカラム名一覧を取得"""
+        return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+
+    def _migrate_wide_prices(self, conn):
+        """productsテーブルのprice_◯カラムをproduct_pricesへ移し、productsを再作成"""
+        columns = self._get_table_columns(conn, 'products')
+        price_columns = [col for col in columns if col.startswith('price_')]
+        if not price_columns:
+            return
+        
+        logging.info(f"価格カラム {len(price_columns)} 件を価格テーブルへ移行します")
+        base_columns = [col for col in columns if not col.startswith('price_')]
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            for col in price_columns:
+                quantity = int(col.replace('price_', ''))
+                cursor.execute(f"""
+                    INSERT OR REPLACE INTO product_prices (product_id, quantity, price)
+                    SELECT product_id, {quantity}, {col} FROM products
+                    WHERE product_id IS NOT NULL AND {col} IS NOT NULL
+                """)
+            
+            # 価格カラムを除いたテーブルに作り直す
+            cursor.execute("DROP VIEW IF EXISTS products_wide")
+            cursor.execute(f"CREATE TABLE products_new ({PRODUCT_COLUMNS_SQL})")
+            columns_str = ', '.join(base_columns)
+            cursor.execute(f"INSERT INTO products_new ({columns_str}) SELECT {columns_str} FROM products")
+            cursor.execute("DROP TABLE products")
+            cursor.execute("ALTER TABLE products_new RENAME TO products")
+            conn.commit()
+            logging.info("価格テーブルへの移行が完了しました")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _add_missing_columns(self, conn):
+        """後から追加したカラムが既存のproductsテーブルになければ追加"""
+        columns = self._get_table_columns(conn, 'products')
+        for col, col_type in ADDED_PRODUCT_COLUMNS.items():
+            if col not in columns:
+                conn.execute(f"ALTER TABLE products ADD COLUMN {col} {col_type}")
+                logging.info(f"productsテーブルにカラム {col} を追加しました")
+        conn.commit()
+
+    def _migrate_jst_timestamps(self, conn):
+        """save_product_idsがJSTで保存していたproductsの日時をUTCに揃える（1回だけ実行）
+
+        created_atは商品IDの保存時に作成されるためすべてJST。updated_atはsave_product（UTC）でも
+        更新されるため、詳細取得日時（UTC）より後の値と詳細未取得の行をJSTとみなして変換する。
+        """
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            cursor.execute("""
+                UPDATE products SET updated_at = datetime(updated_at, ?)
+                WHERE updated_at IS NOT NULL
+                AND (detail_checked_at IS NULL OR updated_at > detail_checked_at)
+            """, (JST_OFFSET_MODIFIER,))
+            cursor.execute(
+                "UPDATE products SET created_at = datetime(created_at, ?) WHERE created_at IS NOT NULL",
+                (JST_OFFSET_MODIFIER,)
+            )
+            migrated = cursor.rowcount
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+            if migrated:
+                logging.info(f"商品 {migrated} 件の日時をUTCに変換しました")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
         finally:
             cursor.close()
 
+    def _create_wide_view(self, conn):
+        """product_pricesを price_◯ カラムに展開した互換ビュー products_wide を作成"""
+        price_columns_str = ',\n'.join(
+            f'MAX(CASE WHEN pp.quantity = {q} THEN pp.price END) AS price_{q}' for q in QUANTITIES
+        )
+        conn.execute("DROP VIEW IF EXISTS products_wide")
+        conn.execute(f"""
+            CREATE VIEW products_wide AS
+            SELECT p.*,
+            {price_columns_str}
+            FROM products p
+            LEFT JOIN product_prices pp ON pp.product_id = p.product_id
+            GROUP BY p.id
+        """)
+        conn.commit()
+
+    @_serialized_write
     def save_product(self, product_data):
         """商品情報を保存"""
         try:
@@ -152,37 +407,49 @@ class Database:
                 'standard_width': '規格幅'
             }
             
-            # 価格データの処理
+            # 価格データの処理（枚数 → 価格）
             price_data = {}
             for key, value in product_data.items():
                 if '枚の価格' in key:
                     quantity = int(key.replace('枚の価格', ''))
-                    price_data[f'price_{quantity}'] = value
+                    price_data[quantity] = value
+            
+            details = {col: product_data.get(key) for col, key in column_mapping.items()}
+            content_hash = compute_content_hash(details, price_data)
             
             if existing:
+                # 内容が前回と同じ場合は詳細取得日時だけを更新
+                if existing['content_hash'] == content_hash:
+                    cursor.execute(
+                        "UPDATE products SET detail_checked_at = datetime('now') WHERE product_id = ?",
+                        (product_data['商品コード'],)
+                    )
+                    conn.commit()
+                    logging.debug(f"商品情報に変更はありません: {product_data['商品コード']}")
+                    return
+                
                 # 価格データの変更をチェック
-                price_changed = False
-                for col, val in price_data.items():
-                    if existing[col] != val:
-                        price_changed = True
-                        break
+                cursor.execute('SELECT quantity, price FROM product_prices WHERE product_id = ?', (product_data['商品コード'],))
+                existing_prices = {row['quantity']: row['price'] for row in cursor.fetchall()}
+                changed_prices = {
+                    q: val for q, val in price_data.items()
+                    if _normalize_value(existing_prices.get(q)) != _normalize_value(val)
+                }
                 
-                # 空でない値だけを更新対象にする
+                # 空でなく、保存済みの値から変わったカラムだけを更新対象にする
                 columns = []
                 values = []
-                for col, key in column_mapping.items():
-                    val = product_data.get(key)
-                    if val is not None and str(val).strip() != "":
+                for col, val in details.items():
+                    if val is not None and str(val).strip() != "" and _normalize_value(existing[col]) != _normalize_value(val):
                         columns.append(f"{col} = ?")
                         values.append(val)
                 
-                # 価格データの更新
-                for col, val in price_data.items():
-                    columns.append(f"{col} = ?")
-                    values.append(val)
-                
-                # updated_atは必ず更新
-                columns.append("updated_at = datetime('now')")
+                # updated_atは内容が変わった場合のみ、詳細取得日時とハッシュは必ず更新
+                if columns or changed_prices:
+                    columns.append("updated_at = datetime('now')")
+                columns.append("detail_checked_at = datetime('now')")
+                columns.append("content_hash = ?")
+                values.append(content_hash)
                 sql = f'''
                     UPDATE products SET
                     {", ".join(columns)}
@@ -191,13 +458,15 @@ class Database:
                 values.append(product_data['商品コード'])
                 cursor.execute(sql, values)
                 
+                # 変更された価格だけを更新
+                self._upsert_prices(cursor, product_data['商品コード'], changed_prices)
+                
                 # 価格データが変更された場合のみログを出力
-                if price_changed:
-                    logging.info(f"商品情報を更新しました（価格変更）: {product_data['商品コード']}")
+                if changed_prices:
+                    logging.debug(f"商品情報を更新しました（価格変更 {len(changed_prices)} 件）: {product_data['商品コード']}")
             else:
-                # 挿入時は従来通り
-                columns = list(column_mapping.keys()) + list(price_data.keys()) + ['created_at', 'updated_at']
-                placeholders = ['?'] * (len(column_mapping) + len(price_data)) + ["datetime('now')", "datetime('now')"]
+                columns = list(column_mapping.keys()) + ['content_hash', 'created_at', 'updated_at', 'detail_checked_at']
+                placeholders = ['?'] * (len(column_mapping) + 1) + ["datetime('now')", "datetime('now')", "datetime('now')"]
                 sql = f'''
                     INSERT INTO products (
                     {", ".join(columns)}
@@ -205,10 +474,10 @@ class Database:
                     {", ".join(placeholders)}
                     )
                 '''
-                values = [product_data.get(column_mapping[col]) for col in column_mapping.keys()]
-                values.extend(price_data.values())
+                values = list(details.values()) + [content_hash]
                 cursor.execute(sql, values)
-                logging.info(f"商品情報を新規保存しました: {product_data['商品コード']}")
+                self._upsert_prices(cursor, product_data['商品コード'], price_data)
+                logging.debug(f"商品情報を新規保存しました: {product_data['商品コード']}")
             
             conn.commit()
             
@@ -218,59 +487,83 @@ class Database:
         finally:
             cursor.close()
 
+    def _upsert_prices(self, cursor, product_id, price_data):
+        """商品の価格（枚数 → 価格）をまとめて保存"""
+        if not price_data:
+            return
+        cursor.executemany('''
+            INSERT INTO product_prices (product_id, quantity, price)
+            VALUES (?, ?, ?)
+            ON CONFLICT(product_id, quantity) DO UPDATE SET price = excluded.price
+        ''', [(product_id, quantity, price) for quantity, price in price_data.items()])
+
+    @_serialized_write
     def save_product_ids(self, product_ids, size):
-        """商品IDと商品名を保存"""
+        """商品IDと商品名を1トランザクションでまとめて保存（新規追加件数と更新件数を返す）"""
+        conn = None
+        cursor = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            # product_idsの形式をログ出力
-            logging.info(f"保存するproduct_ids: {product_ids}")
-            logging.info(f"サイズ: {size}")
+            logging.debug(f"サイズ {size} の商品ID {len(product_ids)} 件を保存します")
             
+            # 保存する行を作成（同じ商品IDは後のデータで上書き）
+            rows = {}
             for product in product_ids:
-                try:
-                    # product_idとnameが存在することを確認
-                    if not isinstance(product, dict) or 'id' not in product or 'name' not in product:
-                        logging.warning(f"無効な商品データ形式: {product}")
-                        continue
-                    
-                    # 既存のデータを取得（商品名を更新するため）
-                    cursor.execute('SELECT * FROM products WHERE product_id = ?', (str(product['id']),))
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        # 既存の商品名がある場合は更新
-                        cursor.execute('''
-                            UPDATE products 
-                            SET name = ?, size = ?, url = ?, 
-                            updated_at = datetime('now', '+9 hours')
-                            WHERE product_id = ?
-                        ''', (str(product['name']), str(size), str(product['url']), str(product['id'])))
-                        logging.info(f"商品を更新: ID={product['id']}, 名前={product['name']}, サイズ={size}")
-                    else:
-                        # 新規挿入
-                        cursor.execute('''
-                            INSERT INTO products 
-                            (product_id, name, size, url, created_at, updated_at)
-                            VALUES 
-                            (?, ?, ?, ?, datetime('now', '+9 hours'), datetime('now', '+9 hours'))
-                        ''', (str(product['id']), str(product['name']), str(size), str(product['url'])))
-                        logging.info(f"商品を新規追加: ID={product['id']}, 名前={product['name']}, サイズ={size}")
-                    
-                except Exception as e:
-                    logging.error(f"個別の商品保存中にエラー: {str(e)}, 商品データ: {product}")
+                # product_idとnameが存在することを確認
+                if not isinstance(product, dict) or 'id' not in product or 'name' not in product:
+                    logging.warning(f"無効な商品データ形式: {product}")
                     continue
+                product_id = str(product['id'])
+                rows[product_id] = (product_id, str(product['name']), str(size), str(product.get('url')))
+            
+            if not rows:
+                return {'inserted': 0, 'updated': 0}
             
+            # 既存の商品IDを数える（SQLiteの変数上限を超えないよう分割）
+            product_id_list = list(rows)
+            existing_count = 0
+            for start in range(0, len(product_id_list), SQLITE_MAX_VARIABLES):
+                chunk = product_id_list[start:start + SQLITE_MAX_VARIABLES]
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM products WHERE product_id IN ({', '.join(['?'] * len(chunk))})",
+                    chunk
+                )
+                existing_count += cursor.fetchone()[0]
+            
+            # 新規は挿入、既存は商品名・サイズ・URLを更新
+            # これらが変わった場合は、次回の詳細取得で値を書き戻すよう内容のハッシュを消去する
+            cursor.executemany('''
+                INSERT INTO products 
+                (product_id, name, size, url, created_at, updated_at)
+                VALUES 
+                (?, ?, ?, ?, datetime('now'), datetime('now'))
+                ON CONFLICT(product_id) DO UPDATE SET
+                name = excluded.name,
+                size = excluded.size,
+                url = excluded.url,
+                updated_at = excluded.updated_at,
+                content_hash = CASE
+                    WHEN name IS excluded.name AND size IS excluded.size AND url IS excluded.url
+                    THEN content_hash
+                END
+            ''', list(rows.values()))
             conn.commit()
-            logging.info(f"商品ID {len(product_ids)} 件を保存しました")
+            
+            result = {'inserted': len(rows) - existing_count, 'updated': existing_count}
+            logging.debug(f"商品ID {len(rows)} 件を保存しました（新規: {result['inserted']} 件, 更新: {result['updated']} 件）")
+            return result
             
         except Exception as e:
+            if conn:
+                conn.rollback()
             logging.error(f"商品IDの保存中にエラーが発生: {str(e)}")
             logging.error(f"エラーの詳細:", exc_info=True)
             raise
         finally:
-            cursor.close()
+            if cursor:
+                cursor.close()
 
     def get_products_by_size(self, size=None):
         """指定されたサイズの商品を取得（size=Noneの場合は全商品）"""
@@ -278,9 +571,9 @@ class Database:
             conn = self._get_connection()
             cursor = conn.cursor()
             if size is not None:
-                cursor.execute('SELECT * FROM products WHERE size = ?', (size,))
+                cursor.execute('SELECT * FROM products_wide WHERE size = ?', (size,))
             else:
-                cursor.execute('SELECT * FROM products')
+                cursor.execute('SELECT * FROM products_wide')
             return cursor.fetchall()
         except sqlite3.Error as e:
             logging.error(f"商品情報の取得中にエラーが発生: {str(e)}")
@@ -288,6 +581,403 @@ class Database:
         finally:
             cursor.close()
 
+    def get_products_needing_refresh(self, max_age_hours=DETAIL_MAX_AGE_HOURS, size=None):
+        """詳細が未取得、または最終取得から指定時間以上経過した商品IDを古い順に取得"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            sql = '''
+                SELECT product_id FROM products
+                WHERE (detail_checked_at IS NULL OR detail_checked_at < datetime('now', ?))
+            '''
+            params = [f'-{float(max_age_hours)} hours']
+            if size is not None:
+                sql += ' AND size = ?'
+                params.append(str(size))
+            sql += ' ORDER BY detail_checked_at, id'
+            cursor.execute(sql, params)
+            product_ids = [row['product_id'] for row in cursor.fetchall()]
+            logging.info(f"詳細の取得が必要な商品数: {len(product_ids)} 件（{max_age_hours}時間以上未更新・サイズ: {size or '全て'}）")
+            return product_ids
+        except sqlite3.Error as e:
+            logging.error(f"取得対象の商品の抽出中にエラーが発生: {str(e)}")
+            return []
+        finally:
+            cursor.close()
+
+    def get_prices_by_quantity(self, quantity, size=None):
+        """指定した枚数での全商品の価格を取得（安い順）"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            sql = '''
+                SELECT p.product_id, p.name, p.size, pp.price
+                FROM product_prices pp
+                JOIN products p ON p.product_id = pp.product_id
+                WHERE pp.quantity = ?
+            '''
+            params = [int(quantity)]
+            if size is not None:
+                sql += ' AND p.size = ?'
+                params.append(size)
+            cursor.execute(sql + ' ORDER BY pp.price', params)
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"枚数別価格の取得中にエラーが発生: {str(e)}")
+            return []
+        finally:
+            cursor.close()
+
+    def _build_product_filters(self, filters):
+        """絞り込み条件（dict）からWHERE句とパラメータを作成
+
+        対応するキー:
+            size: サイズ
+            text: 商品IDまたは商品名の部分一致
+            dimensions: {寸法カラム: (最小値, 最大値)}（Noneは制限なし）
+            created_from / created_to: 作成日時の範囲（'YYYY-MM-DD'）
+        """
+        filters = filters or {}
+        conditions = []
+        params = []
+        if filters.get('size'):
+            conditions.append('size = ?')
+            params.append(str(filters['size']))
+        if filters.get('text'):
+            conditions.append("(product_id LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\')")
+            pattern = '%' + str(filters['text']).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            params.extend([pattern, pattern])
+        for column, (minimum, maximum) in (filters.get('dimensions') or {}).items():
+            if column not in DIMENSION_COLUMNS:
+                raise ValueError(f"絞り込みできない寸法カラムです: {column}")
+            if minimum is not None:
+                conditions.append(f'{column} >= ?')
+                params.append(minimum)
+            if maximum is not None:
+                conditions.append(f'{column} <= ?')
+                params.append(maximum)
+        # 日付はJSTで指定されるため、UTCで保存された作成日時と比べられるよう変換する
+        if filters.get('created_from'):
+            conditions.append('created_at >= datetime(?, ?)')
+            params.extend([str(filters['created_from']), JST_OFFSET_MODIFIER])
+        if filters.get('created_to'):
+            # 終了日はその日の終わりまで含める
+            conditions.append("created_at < datetime(?, '+1 day', ?)")
+            params.extend([str(filters['created_to']), JST_OFFSET_MODIFIER])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return where, params
+
+    def count_products(self, filters=None):
+        """絞り込み条件に一致する商品数を取得"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            where, params = self._build_product_filters(filters)
+            cursor.execute(f'SELECT COUNT(*) FROM products {where}', params)
+            return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            logging.error(f"商品数の取得中にエラーが発生: {str(e)}")
+            return 0
+        finally:
+            cursor.close()
+
+    def load_products_dataframe(self, filters=None, limit=None, offset=0):
+        """絞り込み条件に一致する商品を型付きのDataFrameで取得（価格は price_◯ カラムに展開）
+
+        サイズ・材質などはcategory、価格はInt32（欠損可）、日時はJSTのdatetime64に変換する。
+        """
+        try:
+            conn = self._get_connection()
+            where, params = self._build_product_filters(filters)
+            sql = f"SELECT * FROM products {where} ORDER BY created_at DESC, id DESC"
+            if limit is not None:
+                sql += " LIMIT ? OFFSET ?"
+                params = params + [int(limit), int(offset)]
+            products_df = pd.read_sql_query(sql, conn, params=params)
+            if products_df.empty:
+                return products_df
+            
+            # 文字列・数値カラムの型を指定
+            for col in CATEGORY_COLUMNS:
+                products_df[col] = products_df[col].astype('category')
+            for col in DIMENSION_COLUMNS + ('standard_width',):
+                products_df[col] = pd.to_numeric(products_df[col], errors='coerce').astype('float32')
+            products_df['id'] = products_df['id'].astype('int32')
+            
+            # 日時はUTCで保存されているため、まとめてJSTに変換
+            for col in ('created_at', 'updated_at'):
+                products_df[col] = pd.to_datetime(products_df[col], errors='coerce', utc=True).dt.tz_convert(jst)
+            
+            # 対象商品の価格を縦持ちで取得し、price_◯ カラムに展開
+            prices_df = self._load_prices_dataframe(conn, products_df['product_id'].tolist(), where, params, limit)
+            if not prices_df.empty:
+                price_wide = prices_df.pivot(index='product_id', columns='quantity', values='price')
+                price_wide = price_wide.reindex(columns=[q for q in QUANTITIES if q in price_wide.columns])
+                price_wide.columns = [f'price_{q}' for q in price_wide.columns]
+                products_df = products_df.join(price_wide.astype('Int32'), on='product_id')
+            return products_df
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            logging.error(f"商品情報の取得中にエラーが発生: {str(e)}")
+            return pd.DataFrame()
+
+    def _load_prices_dataframe(self, conn, product_ids, where, params, limit):
+        """商品の価格を縦持ちのDataFrameで取得"""
+        if limit is None:
+            # 全件（または条件に一致する全商品）の場合は結合で取得
+            filtered = f"SELECT product_id FROM products {where}" if where else "SELECT product_id FROM products"
+            sql = f"SELECT product_id, quantity, price FROM product_prices WHERE product_id IN ({filtered})"
+            return pd.read_sql_query(sql, conn, params=params)
+        
+        frames = []
+        for start in range(0, len(product_ids), SQLITE_MAX_VARIABLES):
+            chunk = product_ids[start:start + SQLITE_MAX_VARIABLES]
+            sql = f"SELECT product_id, quantity, price FROM product_prices WHERE product_id IN ({', '.join(['?'] * len(chunk))})"
+            frames.append(pd.read_sql_query(sql, conn, params=chunk))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def get_sizes(self):
+        """登録されているサイズの一覧を取得"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT DISTINCT size FROM products WHERE size IS NOT NULL ORDER BY size')
+            return [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"サイズ一覧の取得中にエラーが発生: {str(e)}")
+            return []
+        finally:
+            cursor.close()
+
+    @_serialized_write
+    def create_job(self, mode, size=None, product_ids=None, workers=1, max_age_hours=None):
+        """クロールジョブを登録してIDを返す"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            product_ids = [str(product_id) for product_id in product_ids] if product_ids is not None else None
+            cursor.execute('''
+                INSERT INTO crawl_jobs (mode, size, product_ids, workers, max_age_hours, total)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                mode,
+                size,
+                json.dumps(product_ids) if product_ids is not None else None,
+                int(workers),
+                max_age_hours,
+                len(product_ids) if product_ids is not None else 0,
+            ))
+            conn.commit()
+            logging.info(f"ジョブ {cursor.lastrowid} を登録しました（モード: {mode}, サイズ: {size}）")
+            return cursor.lastrowid
+        except sqlite3.Error as e:
+            logging.error(f"ジョブの登録中にエラーが発生: {str(e)}")
+            raise
+        finally:
+            cursor.close()
+
+    @_serialized_write
+    def claim_next_job(self):
+        """待機中のジョブを1件取り出して実行中にする（なければNone）"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM crawl_jobs WHERE status = 'queued' ORDER BY id LIMIT 1")
+            job = cursor.fetchone()
+            if not job:
+                return None
+            cursor.execute('''
+                UPDATE crawl_jobs SET status = 'running', started_at = datetime('now')
+                WHERE id = ? AND status = 'queued'
+            ''', (job['id'],))
+            conn.commit()
+            if cursor.rowcount == 0:
+                return None
+            job = dict(job)
+            job['product_ids'] = json.loads(job['product_ids']) if job['product_ids'] else None
+            return job
+        except sqlite3.Error as e:
+            logging.error(f"ジョブの取得中にエラーが発生: {str(e)}")
+            return None
+        finally:
+            cursor.close()
+
+    @_serialized_write
+    def update_job(self, job_id, **fields):
+        """ジョブの状態・進捗を更新（failuresはリストで渡す）"""
+        if not fields:
+            return
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            if 'failures' in fields:
+                fields['failures'] = json.dumps(fields['failures'], ensure_ascii=False)
+            columns = [f"{col} = ?" for col in fields]
+            values = list(fields.values())
+            if fields.get('status') in ('completed', 'failed'):
+                columns.append("finished_at = datetime('now')")
+            cursor.execute(f"UPDATE crawl_jobs SET {', '.join(columns)} WHERE id = ?", values + [job_id])
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"ジョブの更新中にエラーが発生: {str(e)}")
+        finally:
+            cursor.close()
+
+    @_serialized_write
+    def requeue_interrupted_jobs(self):
+        """プロセス停止で中断された実行中のジョブを待機中に戻す"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE crawl_jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            conn.commit()
+            if cursor.rowcount:
+                logging.info(f"中断されたジョブ {cursor.rowcount} 件を再登録しました")
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logging.error(f"ジョブの再登録中にエラーが発生: {str(e)}")
+            return 0
+        finally:
+            cursor.close()
+
+    def get_jobs(self, limit=20):
+        """最近のジョブを新しい順に取得"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, mode, size, workers, status, total, done, failed, failures, error,
+                created_at, started_at, finished_at
+                FROM crawl_jobs ORDER BY id DESC LIMIT ?
+            ''', (int(limit),))
+            jobs = []
+            for row in cursor.fetchall():
+                job = dict(row)
+                job['failures'] = json.loads(job['failures']) if job['failures'] else []
+                jobs.append(job)
+            return jobs
+        except sqlite3.Error as e:
+            logging.error(f"ジョブ一覧の取得中にエラーが発生: {str(e)}")
+            return []
+        finally:
+            cursor.close()
+
+    @_serialized_write
+    def add_cached_page(self, url, unit, content_hash, size):
+        """キャッシュしたページを索引に登録"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO page_cache (url, unit, fetched_at, content_hash, size)
+                VALUES (?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'), ?, ?)
+            ''', (url, int(unit or 0), content_hash, int(size)))
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"ページキャッシュの登録中にエラーが発生: {str(e)}")
+        finally:
+            cursor.close()
+
+    def get_cached_page(self, url, unit, max_age_seconds=None):
+        """URLと単位の最新のキャッシュ（content_hash, fetched_at）を取得（なければNone）"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            sql = '''
+                SELECT content_hash, fetched_at FROM page_cache
+                WHERE url = ? AND unit = ?
+            '''
+            params = [url, int(unit or 0)]
+            if max_age_seconds is not None:
+                sql += " AND fetched_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?)"
+                params.append(f'-{int(max_age_seconds)} seconds')
+            sql += ' ORDER BY fetched_at DESC LIMIT 1'
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logging.error(f"ページキャッシュの取得中にエラーが発生: {str(e)}")
+            return None
+        finally:
+            cursor.close()
+
+    @_serialized_write
+    def evict_cached_pages(self, max_age_seconds, max_bytes):
+        """期限切れ・容量超過のキャッシュを索引から削除し、参照されなくなったcontent_hashを返す"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT DISTINCT content_hash FROM page_cache
+                WHERE fetched_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+            ''', (f'-{int(max_age_seconds)} seconds',))
+            candidates = {row['content_hash'] for row in cursor.fetchall()}
+            cursor.execute(
+                "DELETE FROM page_cache WHERE fetched_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)",
+                (f'-{int(max_age_seconds)} seconds',)
+            )
+            
+            # 容量を超えている場合は古いものから削除（同じ内容のファイルは1つとして数える）
+            cursor.execute('''
+                SELECT content_hash, MAX(size) AS size, MAX(fetched_at) AS last_fetched
+                FROM page_cache GROUP BY content_hash ORDER BY last_fetched
+            ''')
+            files = cursor.fetchall()
+            total = sum(row['size'] for row in files)
+            for row in files:
+                if total <= max_bytes:
+                    break
+                cursor.execute("DELETE FROM page_cache WHERE content_hash = ?", (row['content_hash'],))
+                candidates.add(row['content_hash'])
+                total -= row['size']
+            conn.commit()
+            
+            # 他の行から参照されているファイルは残す
+            removable = []
+            for content_hash in candidates:
+                cursor.execute("SELECT 1 FROM page_cache WHERE content_hash = ? LIMIT 1", (content_hash,))
+                if not cursor.fetchone():
+                    removable.append(content_hash)
+            return removable
+        except sqlite3.Error as e:
+            logging.error(f"ページキャッシュの削除中にエラーが発生: {str(e)}")
+            return []
+        finally:
+            cursor.close()
+
+    @_serialized_write
+    def save_trace_spans(self, trace_id, product_id, spans):
+        """1商品分の処理段階ごとの所要時間（段階名, 秒）を保存し、保持期間を過ぎたものを削除"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO trace_spans (trace_id, product_id, stage, duration) VALUES (?, ?, ?, ?)",
+                [(trace_id, product_id, stage, duration) for stage, duration in spans]
+            )
+            cursor.execute(
+                "DELETE FROM trace_spans WHERE created_at < datetime('now', ?)",
+                (f'-{int(TRACE_RETENTION_DAYS)} days',)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"トレースの保存中にエラーが発生: {str(e)}")
+        finally:
+            cursor.close()
+
+    def load_trace_spans(self, since_hours=None):
+        """処理段階ごとの所要時間をDataFrameで取得（1行が1段階）"""
+        try:
+            conn = self._get_connection()
+            sql = "SELECT trace_id, product_id, stage, duration, created_at FROM trace_spans"
+            params = []
+            if since_hours is not None:
+                sql += " WHERE created_at >= datetime('now', ?)"
+                params.append(f'-{float(since_hours)} hours')
+            return pd.read_sql_query(sql, conn, params=params)
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            logging.error(f"トレースの取得中にエラーが発生: {str(e)}")
+            return pd.DataFrame(columns=['trace_id', 'product_id', 'stage', 'duration', 'created_at'])
+
     def get_url_by_product_id(self, product_id):
         try:
             conn = self._get_connection()
@@ -310,13 +1000,24 @@ class Database:
             self._thread_local.conn.close()
             delattr(self._thread_local, 'conn')
             logging.info("データベース接続を閉じました")
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+
+    def get_data_version(self):
+        """データが変更されるたびに変化する値を取得（PRAGMA data_version）"""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
     
     def get_all_product_ids(self):
         """商品IDテーブルの全データを取得"""
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM products")
+            cursor.execute("SELECT * FROM products_wide")
             return cursor.fetchall()
         except sqlite3.Error as e:
             logging.error(f"商品情報の取得中にエラーが発生: {str(e)}")
@@ -329,7 +1030,7 @@ class Database:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM products")
+            cursor.execute("SELECT * FROM products_wide")
             return cursor.fetchall()
         except sqlite3.Error as e:
             logging.error(f"商品情報の取得中にエラーが発生: {str(e)}")
@@ -399,16 +1100,14 @@ class Database:
                     "SELECT product_id, name, size, created_at FROM products WHERE size = ? ORDER BY created_at DESC",
                     (str(size),)
                 )
-                logging.info(f"サイズ {size} の商品IDを取得しています")
+                logging.debug(f"サイズ {size} の商品IDを取得しています")
             else:
                 cursor.execute("SELECT product_id, name, size, created_at FROM products ORDER BY created_at DESC")
-                logging.info("全商品IDを取得しています")
+                logging.debug("全商品IDを取得しています")
             
             rows = cursor.fetchall()
             result = [dict(row) for row in rows]
-            logging.info(f"取得した商品ID数: {len(result)}")
-            for row in result[:5]:  # 最初の5件だけログ出力
-                logging.info(f"取得した商品: ID={row['product_id']}, 名前={row.get('name', 'なし')}, サイズ={row.get('size', 'なし')}")
+            logging.debug(f"取得した商品ID数: {len(result)}")
             return result
             
         except sqlite3.Error as e:
@@ -435,10 +1134,13 @@ class Database:
             conn = self._get_connection()
             cursor = conn.cursor()
             
+            # 互換ビューの削除
+            cursor.execute("DROP VIEW IF EXISTS products_wide")
+            
             # テーブルの存在確認と削除
             cursor.execute("""
                 SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='products'
+                WHERE type='table' AND name IN ('products', 'product_prices')
             """)
             
             tables = cursor.fetchall()
@@ -460,8 +1162,8 @@ class Database:
             try:
                 if cursor:
                     cursor.close()
-                if conn:
-                    conn.close()
+                # スレッドごとの接続を破棄し、次回利用時に再接続させる
+                self.close()
             except Exception as e:
                 logging.error(f"接続のクローズ中にエラー: {str(e)}")
 
@@ -0,0 +1,73 @@
+import logging
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from rate_limiter import get_scheduler
+from tracing import span
+from config import (
+    HEADERS, HTTP_TIMEOUT, HTTP_POOL_SIZE, HTTP_USE_PROXY, HTTP_MAX_RETRIES, HTTP_RETRY_BACKOFF, HTTP_RETRY_STATUSES
+)
+
+
+class HttpFetcher:
+    """keep-aliveのSessionを使い、JavaScriptが不要なページをHTTPで取得する"""
+
+    def __init__(self, proxy_manager=None, use_proxy=HTTP_USE_PROXY, timeout=HTTP_TIMEOUT, pool_size=HTTP_POOL_SIZE, scheduler=None):
+        self.proxy_manager = proxy_manager
+        # 全ワーカー共通のリクエスト制御（秒間リクエスト数とホストごとの同時接続数）
+        self.scheduler = scheduler or get_scheduler()
+        self.use_proxy = use_proxy
+        self.timeout = timeout
+        self.session = self._create_session(pool_size)
+
+    def _create_session(self, pool_size):
+        """コネクションプール付きのSessionを作成"""
+        session = requests.Session()
+
+        # アダプター側では再試行しない（再試行がリクエスト制御を迂回しないよう fetch で行う）
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        headers = dict(HEADERS)
+        # brotliはrequestsが標準で展開できないため除外する
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        session.headers.update(headers)
+        return session
+
+    def _get_proxies(self):
+        """プロキシ設定を取得（無効な場合はNone）"""
+        if not self.use_proxy or not self.proxy_manager:
+            return None
+        proxy = self.proxy_manager.get_next_proxy()
+        if not proxy:
+            return None
+        return {'http': proxy, 'https': proxy}
+
+    def fetch(self, url, max_retries=HTTP_MAX_RETRIES):
+        """URLを取得してレスポンスを返す（一時的なエラーは試行ごとに許可を取り直して再試行）"""
+        for attempt in range(max_retries + 1):
+            try:
+                with self.scheduler.permit(url), span('http_fetch'):
+                    response = self.session.get(url, timeout=self.timeout, proxies=self._get_proxies())
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == max_retries:
+                    raise
+                logging.debug(f"HTTP取得を再試行します ({attempt + 1}/{max_retries}): {url} ({str(e)})")
+            else:
+                if response.status_code not in HTTP_RETRY_STATUSES or attempt == max_retries:
+                    break
+                logging.debug(f"HTTP {response.status_code} のため再試行します ({attempt + 1}/{max_retries}): {url}")
+                response.close()
+            time.sleep(HTTP_RETRY_BACKOFF * (2 ** attempt))
+        response.raise_for_status()
+
+        # Content-Typeに文字コードがない場合は本文から推定する
+        if not response.encoding or response.encoding.lower() == 'iso-8859-1':
+            response.encoding = response.apparent_encoding
+        logging.debug(f"HTTP取得完了: {url} ({response.elapsed.total_seconds():.3f}秒)")
+        return response
+
+    def close(self):
+        """Sessionを閉じる"""
+        self.session.close()
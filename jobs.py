@@ -0,0 +1,124 @@
+import logging
+import threading
+from database import Database
+from scraper import Scraper, ScraperPool
+from config import JOB_RUNNERS, JOB_POLL_INTERVAL
+
+# ジョブの種類
+JOB_MODE_IDS = 'ids'          # サイズごとの商品ID・商品名・URLの取得
+JOB_MODE_DETAILS = 'details'  # 商品詳細の取得
+
+
+class JobManager:
+    """クロールジョブをSQLiteのキューから取り出し、バックグラウンドのスレッドで実行する"""
+
+    def __init__(self, runners=JOB_RUNNERS, poll_interval=JOB_POLL_INTERVAL):
+        self.db = Database()
+        self.runners = max(1, int(runners))
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """ジョブ実行スレッドを起動（前回のプロセスで中断されたジョブは再実行する）"""
+        if self._threads:
+            return
+        self.db.requeue_interrupted_jobs()
+        for i in range(self.runners):
+            thread = threading.Thread(target=self._run, name=f"crawl-job-runner-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"ジョブ実行スレッドを {self.runners} 件起動しました")
+
+    def stop(self, timeout=None):
+        """ジョブ実行スレッドを停止"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, mode, size=None, product_ids=None, workers=1, max_age_hours=None):
+        """ジョブを登録してIDを返す（実行はバックグラウンドで行う）
+
+        商品詳細の取得で max_age_hours を指定した場合は、実行時に未取得・古い商品だけを対象にする。
+        """
+        if mode not in (JOB_MODE_IDS, JOB_MODE_DETAILS):
+            raise ValueError(f"不明なジョブの種類です: {mode}")
+        if size is None and product_ids is None:
+            raise ValueError("サイズまたは商品IDを指定してください")
+        return self.db.create_job(mode, size=size, product_ids=product_ids, workers=workers, max_age_hours=max_age_hours)
+
+    def _run(self):
+        """待機中のジョブを順に取り出して実行（Scraperはスレッドごとに保持）"""
+        scraper = None
+        try:
+            while not self._stop_event.is_set():
+                job = self.db.claim_next_job()
+                if not job:
+                    self._stop_event.wait(self.poll_interval)
+                    continue
+                if scraper is None:
+                    scraper = Scraper()
+                self._execute(job, scraper)
+        finally:
+            if scraper:
+                scraper.close()
+
+    def _execute(self, job, scraper):
+        """ジョブを実行し、結果をデータベースに記録"""
+        logging.info(f"ジョブ {job['id']} を開始します（モード: {job['mode']}, サイズ: {job['size']}）")
+        try:
+            if job['mode'] == JOB_MODE_IDS:
+                self._run_ids_job(job, scraper)
+            else:
+                self._run_details_job(job, scraper)
+        except Exception as e:
+            logging.error(f"ジョブ {job['id']} の実行中にエラーが発生: {str(e)}", exc_info=True)
+            self.db.update_job(job['id'], status='failed', error=str(e))
+
+    def _run_ids_job(self, job, scraper):
+        """サイズの商品ID・商品名・URLを取得し、1ページ保存するごとに件数を記録"""
+        done = 0
+        for _, products in scraper.iter_product_ids([job['size']]):
+            done += len(products)
+            self.db.update_job(job['id'], done=done)
+        self.db.update_job(job['id'], status='completed', total=done, done=done)
+        logging.info(f"ジョブ {job['id']} が完了しました（商品ID {done} 件）")
+
+    def _run_details_job(self, job, scraper):
+        """商品詳細を取得し、1商品ごとに進捗を記録"""
+        product_ids = job['product_ids']
+        if job['max_age_hours'] is not None:
+            # 差分取得: 中断後の再実行でも、取得済みの商品は詳細取得日時により除外される
+            refresh_ids = self.db.get_products_needing_refresh(job['max_age_hours'], size=job['size'])
+            if product_ids is None:
+                product_ids = refresh_ids
+            else:
+                refresh_set = set(refresh_ids)
+                product_ids = [product_id for product_id in product_ids if product_id in refresh_set]
+        elif product_ids is None:
+            product_ids = [str(p['product_id']) for p in self.db.get_product_ids(job['size'])]
+        self.db.update_job(job['id'], total=len(product_ids))
+
+        done = 0
+        failures = []
+        for product_id, data, error in self._iter_product_details(product_ids, job['workers'], scraper):
+            done += 1
+            if not data:
+                failures.append({'id': product_id, 'reason': error or '商品詳細の取得に失敗'})
+                self.db.update_job(job['id'], done=done, failed=len(failures), failures=failures)
+            else:
+                self.db.update_job(job['id'], done=done)
+
+        self.db.update_job(job['id'], status='completed')
+        logging.info(f"ジョブ {job['id']} が完了しました（成功: {done - len(failures)} 件, 失敗: {len(failures)} 件）")
+
+    def _iter_product_details(self, product_ids, workers, scraper):
+        """商品詳細を取得し (商品ID, データ, エラー) を返す（複数ワーカー指定時はドライバープールを使用）"""
+        if workers and workers > 1:
+            with ScraperPool(workers) as pool:
+                yield from pool.iter_product_details(product_ids)
+            return
+
+        for product_id in product_ids:
+            yield scraper.try_get_product_detail(product_id)
@@ -0,0 +1,91 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import pytz
+from config import LOG_DIR, LOG_LEVEL, LOG_BUFFER_LINES
+
+# JSTタイムゾーンの設定
+jst = pytz.timezone('Asia/Tokyo')
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+_ring_buffer = None
+_setup_lock = threading.Lock()
+
+
+class JSTFormatter(logging.Formatter):
+    """日時をJSTで出力するフォーマッター"""
+
+    def converter(self, timestamp):
+        dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        return dt.astimezone(jst)
+
+    def formatTime(self, record, datefmt=None):
+        dt = self.converter(record.created)
+        if datefmt:
+            return dt.strftime(datefmt)
+        return dt.strftime('%Y-%m-%d %H:%M:%S %Z')
+
+
+class RingBufferHandler(logging.Handler):
+    """直近のログを決まった行数だけメモリに保持するハンドラー（画面表示用）"""
+
+    def __init__(self, capacity=LOG_BUFFER_LINES):
+        super().__init__()
+        self.lines = deque(maxlen=capacity)
+
+    def emit(self, record):
+        try:
+            self.lines.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def get_text(self):
+        """保持しているログを改行区切りの文字列で取得"""
+        return '\n'.join(list(self.lines))
+
+
+def setup_logging(log_dir=LOG_DIR, level=LOG_LEVEL):
+    """ルートロガーにキュー経由のハンドラーを設定（ファイル書き込みはバックグラウンドのスレッドで行う）
+
+    複数回呼び出しても設定は1回だけ行う。
+    """
+    global _listener, _ring_buffer
+    with _setup_lock:
+        if _listener is not None:
+            return _ring_buffer
+
+        os.makedirs(log_dir, exist_ok=True)
+        formatter = JSTFormatter(LOG_FORMAT)
+
+        file_handler = logging.FileHandler(
+            os.path.join(log_dir, f'{datetime.now(jst).strftime("%Y%m%d")}.log'), mode='a', encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+        _ring_buffer = RingBufferHandler()
+        _ring_buffer.setFormatter(formatter)
+
+        # 呼び出し元のスレッドはキューに積むだけにする
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, file_handler, _ring_buffer, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        root.addHandler(QueueHandler(log_queue))
+        root.setLevel(level)
+        # ライブラリの詳細なログは警告以上のみ出力する
+        for name in ('urllib3', 'selenium', 'WDM'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        return _ring_buffer
+
+
+def get_recent_logs():
+    """画面表示用に直近のログを取得"""
+    return _ring_buffer.get_text() if _ring_buffer is not None else ''
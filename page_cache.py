@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from database import Database
+from config import PAGE_CACHE_DIR, PAGE_CACHE_TTL_DAYS, PAGE_CACHE_MAX_MB
+
+# この件数を保存するごとに期限切れ・容量超過のキャッシュを削除する
+EVICT_INTERVAL = 200
+
+
+class PageCache:
+    """取得したページのHTMLをgzip圧縮し、内容のハッシュをファイル名として保存するキャッシュ
+
+    URL・単位・取得日時からファイルへの索引はSQLiteのpage_cacheテーブルに保存する。
+    """
+
+    def __init__(self, cache_dir=PAGE_CACHE_DIR, ttl_days=PAGE_CACHE_TTL_DAYS, max_mb=PAGE_CACHE_MAX_MB, db=None):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.db = db or Database()
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, content_hash):
+        """content_hashに対応するファイルのパス（先頭2文字でディレクトリを分ける）"""
+        return os.path.join(self.cache_dir, content_hash[:2], f"{content_hash}.html.gz")
+
+    def put(self, url, unit, html):
+        """ページのHTMLを保存（同じ内容のファイルが既にあれば索引だけを追加）"""
+        data = html.encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self.db.add_cached_page(url, unit, content_hash, os.path.getsize(path))
+
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % EVICT_INTERVAL == 0
+        if should_evict:
+            self.evict()
+        return content_hash
+
+    def get(self, url, unit=None, ignore_ttl=False):
+        """キャッシュ済みのHTMLを取得（ない場合や期限切れの場合はNone）"""
+        entry = self.db.get_cached_page(url, unit, None if ignore_ttl else self.ttl_seconds)
+        if not entry:
+            return None
+        try:
+            with gzip.open(self._path(entry['content_hash']), 'rb') as f:
+                return f.read().decode('utf-8')
+        except (OSError, EOFError) as e:
+            logging.warning(f"キャッシュファイルを読み込めませんでした: {url} ({str(e)})")
+            return None
+
+    def evict(self):
+        """期限切れ・容量超過のキャッシュを削除"""
+        removable = self.db.evict_cached_pages(self.ttl_seconds, self.max_bytes)
+        for content_hash in removable:
+            try:
+                os.remove(self._path(content_hash))
+            except FileNotFoundError:
+                pass
+        if removable:
+            logging.info(f"ページキャッシュを {len(removable)} 件削除しました")
+        return len(removable)
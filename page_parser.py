@@ -0,0 +1,257 @@
+import re
+import logging
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup, SoupStrainer
+from config import BASE_URL
+
+# 高速なlxmlがインストールされていれば優先して使用する
+try:
+    import lxml  # noqa: F401
+    PARSER_BACKEND = 'lxml'
+except ImportError:
+    PARSER_BACKEND = 'html.parser'
+
+# 例: 276×198×28(深さ) mm
+DIMENSION_PATTERN = re.compile(r'([\d\.]+)×([\d\.]+)×([\d\.]+)')
+NUMBER_PATTERN = re.compile(r'([\d\.]+)')
+PRICE_PATTERN = re.compile(r'change_volume\((\d+),\s*(\d+),')
+PAGE_NUMBER_PATTERN = re.compile(r'[?&]page=(\d+)')
+
+# 価格リスト1つあたりの最大取得件数
+MAX_PRICE_ITEMS = 120
+
+# 詳細ページで解析対象とする領域のID
+DETAIL_REGION_IDS = ('detailsBox', 'small_price_list', 'big_price_list')
+
+# 寸法系の項目名 → (detailsBox上の項目名, 三辺のうちの位置)
+DIMENSION_LABELS = {
+    '長さ (外寸)': ('外寸法', 0),
+    '幅 (外寸)': ('外寸法', 1),
+    '深さ (外寸)': ('外寸法', 2),
+    '長さ (内寸)': ('内寸法', 0),
+    '幅 (内寸)': ('内寸法', 1),
+    '深さ (内寸)': ('内寸法', 2),
+}
+
+# span#more_quality から値を取る項目
+QUALITY_LABEL = '紙質（強度）'
+
+
+def _to_float(text):
+    """文字列をfloatに変換（失敗時はNone）"""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def _has_class(attrs, class_name):
+    """タグ属性のclassに指定のクラスが含まれるか判定"""
+    classes = attrs.get('class') or ''
+    if isinstance(classes, str):
+        classes = classes.split()
+    return class_name in classes
+
+
+def _is_listing_region(name, attrs):
+    """カテゴリページで必要な領域（#resultBox、li.next_page、ページ番号のリンク）か判定"""
+    if name == 'div' and attrs.get('id') == 'resultBox':
+        return True
+    if name == 'a' and PAGE_NUMBER_PATTERN.search(attrs.get('href') or ''):
+        return True
+    return name == 'li' and _has_class(attrs, 'next_page')
+
+
+def _is_detail_region(name, attrs):
+    """詳細ページで必要な領域（#detailsBox と価格リスト）か判定"""
+    return name in ('div', 'ul') and attrs.get('id') in DETAIL_REGION_IDS
+
+
+LISTING_STRAINER = SoupStrainer(_is_listing_region)
+DETAIL_STRAINER = SoupStrainer(_is_detail_region)
+
+
+def parse_listing_page(html):
+    """カテゴリページから商品一覧とページ送りの部分だけを解析"""
+    return BeautifulSoup(html, PARSER_BACKEND, parse_only=LISTING_STRAINER)
+
+
+def parse_detail_page(html):
+    """詳細ページから詳細ボックスと価格リストの部分だけを解析"""
+    return BeautifulSoup(html, PARSER_BACKEND, parse_only=DETAIL_STRAINER)
+
+
+def parse_listing_products(soup):
+    """カテゴリページから商品ID・商品名・URLを取得"""
+    products = []
+    for box in soup.find('div', id='resultBox').find_all('div', class_='product_box'):
+        try:
+            product_name = box.find('h4')
+            product_name = product_name.text.strip() if product_name else ""
+
+            product_id_element = box.find('li', class_='product_id')
+            product_id = product_id_element.get('id') if product_id_element else None
+            if not product_id:
+                continue
+
+            product_url_tag = box.find('a')
+            relative_url = product_url_tag['href'] if product_url_tag and product_url_tag.has_attr('href') else None
+            full_url = urljoin(BASE_URL, relative_url) if relative_url else None
+
+            products.append({
+                'id': product_id,
+                'name': product_name,
+                'url': full_url
+            })
+        except Exception as e:
+            logging.error(f"商品情報の取得中にエラー: {str(e)}")
+            continue
+    return products
+
+
+def get_last_page_number(soup):
+    """ページ送りのリンク（?page=N）から最大のページ番号を取得（リンクがなければ1）"""
+    last_page = 1
+    for a in soup.find_all('a', href=PAGE_NUMBER_PATTERN):
+        last_page = max(last_page, int(PAGE_NUMBER_PATTERN.search(a['href']).group(1)))
+    return last_page
+
+
+def parse_price_list(soup, list_id, item_prefix, max_items=MAX_PRICE_ITEMS):
+    """価格リスト（li#{item_prefix}1, 2, ...）から 枚数→価格 を取得"""
+    price_list = soup.find('ul', id=list_id)
+    if not price_list:
+        return {}
+
+    items = {li['id']: li for li in price_list.find_all('li', id=True)}
+    prices = {}
+    for i in range(1, max_items + 1):
+        item = items.get(f'{item_prefix}{i}')
+        if item is None:
+            break
+        match = PRICE_PATTERN.search(item.get('onclick', ''))
+        if not match:
+            break
+        prices[int(match.group(1))] = int(match.group(2))
+    logging.debug(f"{list_id} から {len(prices)} 件の価格を取得")
+    return prices
+
+
+def extract_product_data(product_id, url, size, soup, unit10_soup):
+    """詳細ページ（1枚単位・10枚単位）から保存用の商品データを作成"""
+    # detailsBoxを1回だけ走査して項目の索引を作成
+    spec = SpecIndex.from_soup(soup)
+    
+    # 商品データの取得（キーはデータベース保存時のカラム名に対応）
+    data = {
+        '商品コード': product_id,
+        '商品名': spec.get_text('商品名'),
+        'サイズ': size,
+        'url': url,
+        '外形_三辺合計': spec.get_numeric('3辺外寸合計'),
+        '長さ_内寸': spec.get_numeric('長さ (内寸)'),
+        '幅_内寸': spec.get_numeric('幅 (内寸)'),
+        '深さ_内寸': spec.get_numeric('深さ (内寸)'),
+        '製法': spec.get_text('フルート'),
+        '長さ_外寸': spec.get_numeric('長さ (外寸)'),
+        '幅_外寸': spec.get_numeric('幅 (外寸)'),
+        '深さ_外寸': spec.get_numeric('深さ (外寸)'),
+        '色': spec.get_text('表面色'),
+        '形式': spec.get_text('箱形式'),
+        '厚み': spec.get_numeric('厚さ'),
+        '材質': spec.get_text(QUALITY_LABEL),
+    }
+    
+    # 価格情報を取得（1枚単位、10枚単位、big_priceの順に反映）
+    price_sources = [
+        (soup, 'small_price_list', 'small_price'),
+        (unit10_soup, 'small_price_list', 'small_price'),
+        (unit10_soup, 'big_price_list', 'big_price'),
+    ]
+    for price_soup, list_id, item_prefix in price_sources:
+        for quantity, price in parse_price_list(price_soup, list_id, item_prefix).items():
+            data[f'{quantity}枚の価格'] = price
+    return data
+
+
+class SpecIndex:
+    """detailsBoxを1回だけ走査して作る 項目名→値 の索引"""
+
+    def __init__(self, details_box):
+        self.found = details_box is not None
+        self.entries = {}
+        self._resolved = {}
+        if details_box is None:
+            return
+
+        for dt in details_box.find_all('dt'):
+            label = dt.get_text(strip=True)
+            # 同じ項目名が複数ある場合は先頭を優先（従来の走査順と同じ）
+            if label in self.entries:
+                continue
+            self.entries[label] = self._parse_entry(dt.find_next_sibling('dd'))
+
+    @classmethod
+    def from_soup(cls, soup):
+        """ページ全体のsoupから索引を作成"""
+        details_box = soup.find('div', id='detailsBox')
+        if details_box is None:
+            logging.warning("detailsBoxが見つかりませんでした")
+        return cls(details_box)
+
+    @staticmethod
+    def _parse_entry(dd):
+        """dd要素からテキスト・数値・三辺寸法を事前に取り出す"""
+        if dd is None:
+            return None
+
+        text = dd.get_text(strip=True)
+        a = dd.find('a')
+        numeric_text = a.get_text(strip=True) if a else text
+        number_match = NUMBER_PATTERN.search(numeric_text)
+        dimension_match = DIMENSION_PATTERN.match(text)
+        quality_span = dd.find('span', id='more_quality')
+
+        return {
+            'text': text,
+            'number': _to_float(number_match.group(1)) if number_match else None,
+            'dimensions': tuple(_to_float(v) for v in dimension_match.groups()) if dimension_match else None,
+            'quality': quality_span.get_text(strip=True) if quality_span else None,
+        }
+
+    def _lookup(self, label):
+        """項目名を含む最初のdtの値を取得（結果は項目名ごとにキャッシュ）"""
+        if label in self._resolved:
+            return self._resolved[label]
+
+        entry = self.entries.get(label)
+        if entry is None and label not in self.entries:
+            for key, value in self.entries.items():
+                if label in key:
+                    entry = value
+                    break
+            else:
+                logging.debug(f"{label} のdt要素が見つかりませんでした")
+        self._resolved[label] = entry
+        return entry
+
+    def get_numeric(self, label):
+        """数値データを取得"""
+        if label in DIMENSION_LABELS:
+            source_label, position = DIMENSION_LABELS[label]
+            entry = self._lookup(source_label)
+            if not entry or not entry['dimensions']:
+                return None
+            return entry['dimensions'][position]
+
+        entry = self._lookup(label)
+        return entry['number'] if entry else None
+
+    def get_text(self, label):
+        """テキストデータを取得"""
+        entry = self._lookup(label)
+        if not entry:
+            return None
+        if label == QUALITY_LABEL:
+            return entry['quality']
+        return entry['text']
@@ -1,19 +1,38 @@
 import requests
 import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from config import PROXY_CONFIGS
+from rate_limiter import get_scheduler
+from log_config import setup_logging
+from config import (
+    PROXY_CONFIGS, PROXY_CHECK_URL, PROXY_CHECK_TIMEOUT, PROXY_CHECK_WORKERS, PROXY_EWMA_ALPHA,
+    PROXY_BREAKER_THRESHOLD, PROXY_BREAKER_COOLDOWN
+)
+
+
+def proxy_label(proxy):
+    """ログ出力用にプロキシURLから認証情報を除いた host:port を取得"""
+    return proxy.rsplit('@', 1)[-1]
+
 
 class ProxyManager:
-    def __init__(self):
+    def __init__(self, check_url=PROXY_CHECK_URL, check_workers=PROXY_CHECK_WORKERS):
         self.proxy_configs = PROXY_CONFIGS
         self.current_proxy_index = 0
         self.working_proxies = []
         self.proxy_stats = {}  # プロキシの使用統計
         self.test_interval = 300  # プロキシテスト間隔（秒）
-        self.timeout = 10  # タイムアウト時間（秒）
+        self.timeout = PROXY_CHECK_TIMEOUT  # タイムアウト時間（秒）
         self.max_retries = 3  # 最大リトライ回数
         self.last_test_time = {}  # 最後のテスト時間
+        self.check_url = check_url  # 動作確認に使うURL
+        self.check_workers = check_workers  # 同時に動作確認するプロキシ数
+        self._lock = threading.Lock()
+        # 動作確認は同時に1回だけ行い、完了するたびに世代を進める
+        self._check_lock = threading.Lock()
+        self._check_generation = 0
         self._init_proxies()
 
     def _init_proxies(self):
@@ -27,7 +46,13 @@ class ProxyManager:
                 'failure_count': 0,
                 'last_success': None,
                 'last_failure': None,
-                'total_response_time': 0
+                'total_response_time': 0,
+                'ewma_response_time': None,  # 応答時間の指数移動平均（秒）
+                'ewma_failure_rate': 0.0,  # 失敗率の指数移動平均（0〜1）
+                'last_result': None,  # 直近の動作確認結果
+                'consecutive_failures': 0,  # 連続失敗回数
+                'circuit_open_until': None,  # 遮断中の場合は再試行を許可する日時
+                'in_use': 0  # このプロキシに割り当て中のドライバー数
             }
             self.last_test_time[proxy_url] = datetime.now() - timedelta(seconds=self.test_interval)
         logging.info(f"{len(self.proxies)}件のプロキシを初期化しました")
@@ -42,15 +67,15 @@ class ProxyManager:
             logging.warning("利用可能なプロキシがありません")
             return None
 
-        # 動作するプロキシを優先
-        if self.working_proxies:
-            proxy = self.working_proxies[self.current_proxy_index % len(self.working_proxies)]
-            self.current_proxy_index = (self.current_proxy_index + 1) % len(self.working_proxies)
-        else:
-            proxy = self.proxies[self.current_proxy_index % len(self.proxies)]
-            self.current_proxy_index = (self.current_proxy_index + 1) % len(self.proxies)
+        # 動作するプロキシを優先し、遮断中のプロキシは除外
+        candidates = [proxy for proxy in (self.working_proxies or self.proxies) if self.is_available(proxy)]
+        if not candidates:
+            logging.warning("遮断されていないプロキシがありません")
+            return None
+        proxy = candidates[self.current_proxy_index % len(candidates)]
+        self.current_proxy_index = (self.current_proxy_index + 1) % len(candidates)
 
-        logging.info(f"プロキシを切り替え: {proxy}")
+        logging.debug(f"プロキシを切り替え: {proxy_label(proxy)}")
         return proxy
 
     def test_proxy(self, proxy, timeout=None):
@@ -58,9 +83,9 @@ class ProxyManager:
         if timeout is None:
             timeout = self.timeout
 
-        # テスト間隔をチェック
+        # テスト間隔内であれば直近の結果を使う
         if (datetime.now() - self.last_test_time[proxy]).total_seconds() < self.test_interval:
-            return self.proxy_stats[proxy]['success_count'] > 0
+            return bool(self.proxy_stats[proxy]['last_result'])
 
         try:
             start_time = time.time()
@@ -69,7 +94,7 @@ class ProxyManager:
                 'https': proxy
             }
             response = requests.get(
-                'http://httpbin.org/ip',
+                self.check_url,
                 proxies=proxies,
                 timeout=timeout
             )
@@ -77,31 +102,103 @@ class ProxyManager:
 
             if response.status_code == 200:
                 self._update_proxy_stats(proxy, success=True, response_time=response_time)
-                logging.info(f"プロキシ動作確認成功: {proxy} (応答時間: {response_time:.2f}秒)")
+                logging.info(f"プロキシ動作確認成功: {proxy_label(proxy)} (応答時間: {response_time:.2f}秒)")
                 return True
+            self._update_proxy_stats(proxy, success=False)
+            logging.warning(f"プロキシ動作確認失敗 ({proxy_label(proxy)}): ステータスコード {response.status_code}")
         except Exception as e:
             self._update_proxy_stats(proxy, success=False)
-            logging.warning(f"プロキシ動作確認失敗 ({proxy}): {str(e)}")
+            logging.warning(f"プロキシ動作確認失敗 ({proxy_label(proxy)}): {str(e)}")
         return False
 
-    def _update_proxy_stats(self, proxy, success, response_time=0):
-        """プロキシの統計情報を更新"""
+    def _update_proxy_stats(self, proxy, success, response_time=None):
+        """プロキシの統計情報（累計と指数移動平均）を更新"""
+        with self._lock:
+            stats = self.proxy_stats[proxy]
+            if success:
+                stats['success_count'] += 1
+                stats['last_success'] = datetime.now()
+                if response_time is not None:
+                    stats['total_response_time'] += response_time
+                    if stats['ewma_response_time'] is None:
+                        stats['ewma_response_time'] = response_time
+                    else:
+                        stats['ewma_response_time'] += PROXY_EWMA_ALPHA * (response_time - stats['ewma_response_time'])
+                stats['consecutive_failures'] = 0
+                stats['circuit_open_until'] = None
+            else:
+                stats['failure_count'] += 1
+                stats['last_failure'] = datetime.now()
+                stats['consecutive_failures'] += 1
+                # 連続して失敗したプロキシは一定時間遮断する
+                if stats['consecutive_failures'] >= PROXY_BREAKER_THRESHOLD:
+                    stats['circuit_open_until'] = datetime.now() + timedelta(seconds=PROXY_BREAKER_COOLDOWN)
+                    logging.warning(f"プロキシを {PROXY_BREAKER_COOLDOWN} 秒間遮断します（連続失敗 {stats['consecutive_failures']} 回）: {proxy_label(proxy)}")
+            stats['ewma_failure_rate'] += PROXY_EWMA_ALPHA * ((0.0 if success else 1.0) - stats['ewma_failure_rate'])
+            stats['last_result'] = success
+            self.last_test_time[proxy] = datetime.now()
+
+    def record_result(self, proxy, success, response_time=None):
+        """プロキシ経由のリクエスト結果を記録（ドライバーなど外部の利用結果用）"""
+        if proxy in self.proxy_stats:
+            self._update_proxy_stats(proxy, success, response_time)
+
+    def is_available(self, proxy):
+        """遮断されていない（または遮断時間を過ぎて再試行できる）プロキシか判定"""
+        open_until = self.proxy_stats[proxy]['circuit_open_until']
+        return open_until is None or datetime.now() >= open_until
+
+    def acquire_proxy(self):
+        """ドライバーに割り当てるプロキシを取得（割り当て数が少なく評価の良いものを優先、なければNone）
+
+        動作確認済みのプロキシだけを割り当てる。初回と、割り当てられるプロキシがなくなった場合は動作確認をやり直す。
+        """
+        generation = self._check_generation
+        proxy = self._assign_working_proxy()
+        if proxy is None:
+            self._refresh_working_proxies(generation)
+            proxy = self._assign_working_proxy()
+        return proxy
+
+    def _assign_working_proxy(self):
+        """動作確認済みで遮断されていないプロキシを1件割り当てる（なければNone）"""
+        with self._lock:
+            candidates = [proxy for proxy in self.working_proxies if self.is_available(proxy)]
+            if not candidates:
+                return None
+            proxy = min(candidates, key=lambda p: (self.proxy_stats[p]['in_use'], self.get_proxy_score(p)))
+            self.proxy_stats[proxy]['in_use'] += 1
+            return proxy
+
+    def _refresh_working_proxies(self, generation):
+        """動作確認をやり直す（待っている間に他のスレッドが確認を終えていれば何もしない）"""
+        with self._check_lock:
+            if self._check_generation != generation:
+                return
+            self.get_working_proxies()
+            self._check_generation += 1
+
+    def release_proxy(self, proxy):
+        """ドライバーへのプロキシの割り当てを解除"""
+        with self._lock:
+            if proxy in self.proxy_stats:
+                self.proxy_stats[proxy]['in_use'] = max(0, self.proxy_stats[proxy]['in_use'] - 1)
+
+    def get_proxy_score(self, proxy):
+        """プロキシの評価値（小さいほど良い）: 応答時間の移動平均 + 失敗率の移動平均 × タイムアウト"""
         stats = self.proxy_stats[proxy]
-        if success:
-            stats['success_count'] += 1
-            stats['last_success'] = datetime.now()
-            stats['total_response_time'] += response_time
-        else:
-            stats['failure_count'] += 1
-            stats['last_failure'] = datetime.now()
-        self.last_test_time[proxy] = datetime.now()
+        # 応答時間が未計測のプロキシはタイムアウトの半分とみなす
+        latency = stats['ewma_response_time'] if stats['ewma_response_time'] is not None else self.timeout / 2
+        return latency + stats['ewma_failure_rate'] * self.timeout
 
     def get_working_proxies(self):
-        """動作するプロキシのリストを取得"""
-        working_proxies = []
-        for proxy in self.proxies:
-            if self.test_proxy(proxy):
-                working_proxies.append(proxy)
+        """動作するプロキシのリストを取得（並行して動作確認し、評価の良い順に並べる）"""
+        with ThreadPoolExecutor(max_workers=max(1, self.check_workers)) as executor:
+            results = list(executor.map(self.test_proxy, self.proxies))
+        working_proxies = sorted(
+            (proxy for proxy, ok in zip(self.proxies, results) if ok),
+            key=self.get_proxy_score
+        )
         
         if not working_proxies:
             logging.error("動作するプロキシが見つかりません")
@@ -120,14 +217,8 @@ class ProxyManager:
         if not self.proxy_stats:
             return None
 
-        best_proxy = max(
-            self.proxy_stats.items(),
-            key=lambda x: (
-                x[1]['success_count'],
-                -x[1]['failure_count'],
-                -x[1]['total_response_time'] / max(x[1]['success_count'], 1)
-            )
-        )[0]
+        # 直近の応答時間と失敗率を重視した評価値で選ぶ
+        best_proxy = min(self.proxy_stats, key=self.get_proxy_score)
         return best_proxy
 
     def make_request_with_proxy(self, url, max_retries=None):
@@ -146,41 +237,57 @@ class ProxyManager:
                     'http': proxy,
                     'https': proxy
                 }
-                response = requests.get(url, proxies=proxies, timeout=self.timeout)
+                with get_scheduler().permit(url):
+                    response = requests.get(url, proxies=proxies, timeout=self.timeout)
                 response.raise_for_status()
-                self._update_proxy_stats(proxy, success=True)
+                self._update_proxy_stats(proxy, success=True, response_time=response.elapsed.total_seconds())
                 return response
             except Exception as e:
                 self._update_proxy_stats(proxy, success=False)
                 logging.warning(f"リクエスト失敗 (試行 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(1)  # リトライ前の待機
 
         logging.error(f"最大リトライ回数を超えました: {url}")
         return None
 
+_proxy_manager = None
+_proxy_manager_lock = threading.Lock()
+
+
+def get_proxy_manager():
+    """プロセス全体で共有するProxyManagerを取得（遮断状態と割り当て数を全てのドライバーで共有する）"""
+    global _proxy_manager
+    with _proxy_manager_lock:
+        if _proxy_manager is None:
+            _proxy_manager = ProxyManager()
+        return _proxy_manager
+
+
 def main():
     """メイン処理"""
+    setup_logging()
     try:
         proxy_manager = ProxyManager()
         working_proxies = proxy_manager.get_working_proxies()
         if working_proxies:
             print("動作するプロキシを取得しました:")
             for proxy in working_proxies:
-                print(proxy)
+                print(proxy_label(proxy))
             
             print("\nプロキシの統計情報:")
             stats = proxy_manager.get_proxy_stats()
             for proxy, stat in stats.items():
-                print(f"\n{proxy}:")
+                print(f"\n{proxy_label(proxy)}:")
                 print(f"  成功回数: {stat['success_count']}")
                 print(f"  失敗回数: {stat['failure_count']}")
                 if stat['success_count'] > 0:
                     avg_time = stat['total_response_time'] / stat['success_count']
                     print(f"  平均応答時間: {avg_time:.2f}秒")
+                if stat['ewma_response_time'] is not None:
+                    print(f"  直近の応答時間（移動平均）: {stat['ewma_response_time']:.2f}秒")
+                print(f"  直近の失敗率（移動平均）: {stat['ewma_failure_rate']:.2f}")
             
             best_proxy = proxy_manager.get_best_proxy()
-            print(f"\n最適なプロキシ: {best_proxy}")
+            print(f"\n最適なプロキシ: {proxy_label(best_proxy)}")
     except Exception as e:
         print(f"エラーが発生しました: {str(e)}")
 
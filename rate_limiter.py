@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from tracing import span
+from config import REQUEST_RATE, REQUEST_BURST, PER_HOST_CONCURRENCY
+
+
+class RequestScheduler:
+    """全ワーカー共通のリクエスト制御（トークンバケットによる秒間リクエスト数とホストごとの同時接続数）"""
+
+    def __init__(self, rate=REQUEST_RATE, burst=REQUEST_BURST, per_host_concurrency=PER_HOST_CONCURRENCY):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.per_host_concurrency = max(1, int(per_host_concurrency))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._host_semaphores = {}
+        self.stats = {'permits': 0, 'wait_seconds': 0.0}
+
+    def _get_host_semaphore(self, host):
+        """ホストごとの同時接続数を制限するセマフォを取得"""
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+            return self._host_semaphores[host]
+
+    def _reserve_token(self):
+        """トークンを1つ予約し、使えるようになるまでの待ち時間（秒）を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 不足分はマイナスとして予約し、後続のリクエストはその分だけ後ろにずらす
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    @contextmanager
+    def permit(self, url):
+        """リクエスト1件分の許可を取得（withブロックの間はホストの同時接続枠を占有する）"""
+        host = urlsplit(url).hostname or ''
+        semaphore = self._get_host_semaphore(host)
+        started = time.monotonic()
+        with span('rate_limit_wait'):
+            semaphore.acquire()
+            if self.rate > 0:
+                wait = self._reserve_token()
+                if wait:
+                    time.sleep(wait)
+        try:
+            waited = time.monotonic() - started
+            with self._lock:
+                self.stats['permits'] += 1
+                self.stats['wait_seconds'] += waited
+            if waited >= 1:
+                logging.debug(f"リクエスト待機: {waited:.2f}秒 {url}")
+            yield
+        finally:
+            semaphore.release()
+
+    def get_stats(self):
+        """許可したリクエスト数と待機時間の合計・平均を取得"""
+        with self._lock:
+            permits = self.stats['permits']
+            return {
+                **self.stats,
+                'avg_wait_seconds': self.stats['wait_seconds'] / permits if permits else 0.0,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """プロセス全体で共有するRequestSchedulerを取得"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -1,7 +1,8 @@
 import logging
 from database import Database
+from log_config import setup_logging
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 
 def reset_database():
     """データベースのテーブルを再作成"""
@@ -1,15 +1,34 @@
 import time
-import random
 import logging
 import urllib3
 import re
-from bs4 import BeautifulSoup
 import requests
 from database import Database
-from config import SIZES, BASE_URL, CATEGORY_BASE_URL, HEADERS, QUANTITIES
-from proxy_manager import ProxyManager
-from urllib.parse import urljoin
+from config import (
+    SIZES, BASE_URL, CATEGORY_BASE_URL, HEADERS, QUANTITIES, DETAIL_WORKERS, DETAIL_MAX_AGE_HOURS, USE_HTTP_FETCH,
+    PAGE_READY_SELECTOR, PAGE_READY_TIMEOUT, PAGE_MIN_WAIT, UNIT_SWITCH_TIMEOUT, WAIT_POLL_FREQUENCY, LEGACY_PAGE_SLEEP,
+    SINGLE_SESSION_UNITS, CATEGORY_SIZE_WORKERS, CATEGORY_MAX_CONCURRENCY, SELENIUM_USE_PROXY,
+    PAGE_CACHE_ENABLED, PAGE_CACHE_REPLAY, BROWSER_RETRY_BACKOFF
+)
+from proxy_manager import get_proxy_manager
+from fetcher import HttpFetcher
+from rate_limiter import get_scheduler
+from page_cache import PageCache
+from tracing import trace_product, span
+from log_config import setup_logging
+from page_parser import (
+    DETAIL_REGION_IDS, parse_listing_page, parse_detail_page, parse_listing_products, extract_product_data,
+    get_last_page_number
+)
+from urllib.parse import urlsplit
 import os
+import sys
+import json
+import shutil
+import tempfile
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
@@ -17,18 +36,62 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Chromeの --proxy-server は認証情報を受け付けないため、拡張機能で認証に応答する
+PROXY_AUTH_BACKGROUND_JS = """
+chrome.webRequest.onAuthRequired.addListener(
+    function(details, callback) {
+        callback({authCredentials: {username: %s, password: %s}});
+    },
+    {urls: ["<all_urls>"]},
+    ["asyncBlocking"]
+);
+"""
+
+def create_proxy_auth_extension(username, password):
+    """プロキシ認証用のChrome拡張機能（Manifest V3）を一時ディレクトリに作成してパスを返す"""
+    extension_dir = tempfile.mkdtemp(prefix='proxy_auth_')
+    manifest = {
+        'manifest_version': 3,
+        'name': 'Proxy Auth',
+        'version': '1.0',
+        'permissions': ['webRequest', 'webRequestAuthProvider'],
+        'host_permissions': ['<all_urls>'],
+        'background': {'service_worker': 'background.js'},
+    }
+    with open(os.path.join(extension_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    with open(os.path.join(extension_dir, 'background.js'), 'w', encoding='utf-8') as f:
+        f.write(PROXY_AUTH_BACKGROUND_JS % (json.dumps(username), json.dumps(password)))
+    return extension_dir
+
 class Scraper:
-    def __init__(self):
-        self.proxy_manager = ProxyManager()
+    def __init__(self, proxy_manager=None, replay=PAGE_CACHE_REPLAY):
+        # 既定ではプロセス全体で共有するProxyManagerを使い、遮断状態と割り当て数を揃える
+        self.proxy_manager = proxy_manager or get_proxy_manager()
         self.db = Database()
         self.base_url = BASE_URL
         self.category_base_url = CATEGORY_BASE_URL
         self.driver = None
-        self._init_driver()
+        # ドライバーに割り当てたプロキシと、認証用拡張機能のディレクトリ
+        self.driver_proxy = None
+        self._proxy_extension_dir = None
+        # 全ワーカー共通のリクエスト制御（秒間リクエスト数とホストごとの同時接続数）
+        self.scheduler = get_scheduler()
+        # 静的ページ用のHTTPセッション（Seleniumは必要になった時点で起動する）
+        self.http_fetcher = HttpFetcher(self.proxy_manager, scheduler=self.scheduler) if USE_HTTP_FETCH else None
+        # 取得したページのキャッシュ（replay=Trueの場合はキャッシュだけを使い、サイトにはアクセスしない）
+        self.replay = replay
+        self.page_cache = PageCache(db=self.db) if PAGE_CACHE_ENABLED or replay else None
+        # ページごとの待機時間の計測結果
+        self.wait_stats = {'pages': 0, 'wait_seconds': 0.0, 'saved_seconds': 0.0}
+        # 直近のページ遷移での段階ごとの所要時間（秒）
+        self.page_waits = self._new_page_waits()
+        # カテゴリページを並行取得する際、ドライバーは同時に1スレッドだけが操作する
+        self._driver_lock = threading.RLock()
 
     def _init_driver(self):
         """Seleniumドライバーの初期化"""
@@ -39,17 +102,15 @@ class Scraper:
             chrome_options.add_argument('--disable-dev-shm-usage')
             chrome_options.add_argument('--disable-gpu')
             chrome_options.add_argument('--window-size=1920,1080')
-            chrome_options.add_argument('--disable-extensions')
             chrome_options.add_argument('--disable-software-rasterizer')
             chrome_options.add_argument('--disable-setuid-sandbox')
             chrome_options.add_argument('--disable-web-security')
             chrome_options.add_argument('--disable-features=VizDisplayCompositor')
             chrome_options.add_argument('--disable-features=IsolateOrigins,site-per-process')
             
-            # プロキシの設定（一時的に無効化）
-            # best_proxy = self.proxy_manager.get_best_proxy()
-            # if best_proxy:
-            #     chrome_options.add_argument(f'--proxy-server={best_proxy}')
+            # プロキシの設定（認証付きプロキシは拡張機能で認証する）
+            if not self._configure_proxy(chrome_options):
+                chrome_options.add_argument('--disable-extensions')
             
             # ChromeDriverの設定
             service = Service(executable_path='/usr/bin/chromedriver')
@@ -67,62 +128,286 @@ class Scraper:
             logging.error(f"Seleniumドライバーの初期化に失敗: {str(e)}")
             if self.driver:
                 self.driver.quit()
+                self.driver = None
+            self._release_driver_proxy()
             raise
 
-    def make_request(self, url, unit=None, max_retries=5):
+    def _configure_proxy(self, chrome_options):
+        """ProxyManagerから割り当てたプロキシをChromeに設定（認証用拡張機能を読み込んだ場合はTrue）"""
+        if not SELENIUM_USE_PROXY:
+            return False
+        proxy = self.proxy_manager.acquire_proxy()
+        if not proxy:
+            logging.warning("利用できるプロキシがないため、直接接続でドライバーを起動します")
+            return False
+        
+        parts = urlsplit(proxy)
+        chrome_options.add_argument(f'--proxy-server={parts.scheme}://{parts.hostname}:{parts.port}')
+        if parts.username:
+            self._proxy_extension_dir = create_proxy_auth_extension(parts.username, parts.password or '')
+            chrome_options.add_argument(f'--load-extension={self._proxy_extension_dir}')
+        self.driver_proxy = proxy
+        logging.info(f"ドライバーをプロキシ経由で起動します: {parts.hostname}:{parts.port}")
+        return bool(parts.username)
+
+    def _release_driver_proxy(self):
+        """ドライバーに割り当てたプロキシと認証用拡張機能を解放"""
+        if self.driver_proxy:
+            self.proxy_manager.release_proxy(self.driver_proxy)
+            self.driver_proxy = None
+        if self._proxy_extension_dir:
+            shutil.rmtree(self._proxy_extension_dir, ignore_errors=True)
+            self._proxy_extension_dir = None
+
+    def _ensure_driver(self):
+        """ドライバーが未起動であれば初期化"""
+        if self.driver is None:
+            self._init_driver()
+
+    def make_request(self, url, unit=None, max_retries=5, required_marker=None):
+        """ページを取得してキャッシュに保存（replayモードではキャッシュから返す）"""
+        if self.replay:
+            return self._build_response(self._get_cached_html(url, unit))
+        response = self._fetch_page(url, unit=unit, max_retries=max_retries, required_marker=required_marker)
+        self._store_page(url, unit, response.text)
+        return response
+
+    def _fetch_page(self, url, unit=None, max_retries=5, required_marker=None):
+        """ページを取得（単位切り替えが不要なページはHTTP、それ以外はSeleniumを使用）"""
+        if unit is None and self.http_fetcher is not None:
+            try:
+                response = self.http_fetcher.fetch(url)
+                # 必要な要素が含まれていない場合はJavaScript描画が必要とみなす
+                if required_marker is None or required_marker in response.text:
+                    return response
+                logging.warning(f"HTTP取得結果に {required_marker} が含まれないためSeleniumで再取得します: {url}")
+            except Exception as e:
+                logging.warning(f"HTTP取得に失敗したためSeleniumで再取得します: {url} ({str(e)})")
+        return self._make_browser_request(url, unit=unit, max_retries=max_retries)
+
+    def _make_browser_request(self, url, unit=None, max_retries=5):
         """Seleniumを使用してリクエストを送信"""
+        def load():
+            started = self._load_page(url)
+            
+            if unit:
+                with span('unit_switch'):
+                    self._switch_unit(unit)
+            
+            self._apply_wait_floor(started)
+            self._record_wait(url)
+            
+            # HTMLを取得してレスポンスオブジェクトを作成
+            with span('page_source'):
+                return self._build_response(self.driver.page_source)
+        
+        return self._with_browser_retries(load, max_retries)
+
+    def _build_response(self, html):
+        """HTMLからレスポンスオブジェクトを作成"""
+        response = requests.Response()
+        response._content = html.encode('utf-8')
+        response.status_code = 200
+        response.encoding = 'utf-8'
+        return response
+
+    def _store_page(self, url, unit, html):
+        """取得したページをキャッシュに保存（失敗してもスクレイピングは続ける）"""
+        if self.page_cache is None:
+            return
+        try:
+            with span('cache_store'):
+                self.page_cache.put(url, unit, html)
+        except OSError as e:
+            logging.warning(f"ページキャッシュの保存に失敗: {url} ({str(e)})")
+
+    def _get_cached_html(self, url, unit):
+        """replayモード用にキャッシュ済みのHTMLを取得（期限切れでも使用する）"""
+        html = self.page_cache.get(url, unit, ignore_ttl=True)
+        if html is None:
+            raise LookupError(f"キャッシュにページがありません: {url} (単位: {unit})")
+        return html
+
+    def fetch_unit_snapshots(self, url, units=(1, 10), max_retries=5):
+        """1回のページ遷移のまま単位タブを切り替え、単位ごとに詳細ボックスと価格リストのHTMLを取得"""
+        if self.replay:
+            return {unit: self._get_cached_html(url, unit) for unit in units}
+        
+        def load():
+            started = self._load_page(url)
+            snapshots = {}
+            for unit in units:
+                with span('unit_switch'):
+                    self._switch_unit(unit)
+                if not snapshots:
+                    self._apply_wait_floor(started)
+                with span('snapshot_regions'):
+                    snapshots[unit] = self._snapshot_regions()
+            self._record_wait(url)
+            return snapshots
+        
+        snapshots = self._with_browser_retries(load, max_retries)
+        for unit, html in snapshots.items():
+            self._store_page(url, unit, html)
+        return snapshots
+
+    def _with_browser_retries(self, load, max_retries):
+        """ブラウザ操作を実行し、失敗した場合は再試行"""
         for attempt in range(max_retries):
             try:
-                # ページの読み込みを待機
-                self.driver.get(url)
-                WebDriverWait(self.driver, 30).until(
-                    EC.presence_of_element_located((By.TAG_NAME, "body"))
-                )
-                
-                if unit:
-                    try:
-                        # 単位切り替えボタンが存在するか確認
-                        unit_button = WebDriverWait(self.driver, 10).until(
-                            EC.presence_of_element_located((By.ID, f"unit_{unit}"))
-                        )
-                        
-                        # JavaScriptを使用してクリックを実行
-                        self.driver.execute_script("arguments[0].click();", unit_button)
-                        
-                        # 価格リストの更新を待機
-                        WebDriverWait(self.driver, 30).until(
-                            lambda driver: "change_volume(" in driver.page_source
-                        )
-                    except TimeoutException:
-                        logging.info(f"unit_{unit} ボタンが存在しないためスキップします")
-                        # スキップして次の処理へ
-                
-                # ページの読み込みを待機
-                time.sleep(3)
-                
-                # HTMLを取得
-                html = self.driver.page_source
-                
-                # レスポンスオブジェクトを作成
-                response = requests.Response()
-                response._content = html.encode('utf-8')
-                response.status_code = 200
-                response.encoding = 'utf-8'
-                
-                return response
-                
+                with self._driver_lock:
+                    self._ensure_driver()
+                    result = load()
+                    # プロキシの応答時間はページ遷移（driver.get）の所要時間だけで評価する
+                    # （リクエスト制御の待ちや単位切り替え・待機を含めない）
+                    if self.driver_proxy:
+                        self.proxy_manager.record_result(self.driver_proxy, True, self.page_waits['driver_get'])
+                    return result
             except Exception as e:
                 if attempt == 0:
                     logging.warning(f"リクエスト失敗 (試行 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(random.uniform(5, 10))  # 再試行前の待機時間を延長
-                else:
+                self._recycle_failed_proxy()
+                if attempt == max_retries - 1:
                     raise
+                # ドライバーの再起動はリクエスト制御を通らないため、ロックの外で間隔を空けてから再試行する
+                time.sleep(BROWSER_RETRY_BACKOFF * (2 ** attempt))
+
+    def _recycle_failed_proxy(self):
+        """プロキシの失敗を記録し、遮断されたプロキシのドライバーは健全なプロキシで起動し直す"""
+        with self._driver_lock:
+            proxy = self.driver_proxy
+            if not proxy:
+                return
+            self.proxy_manager.record_result(proxy, False)
+            if self.proxy_manager.is_available(proxy):
+                return
+            logging.warning(f"プロキシが遮断されたため、ドライバーを別のプロキシで再起動します: {urlsplit(proxy).hostname}")
+            # 次回の _ensure_driver で別のプロキシが割り当てられる
+            self._quit_driver()
+
+    @staticmethod
+    def _new_page_waits():
+        """ページ遷移・準備完了待ち・単位切り替え待ち・最低待機の所要時間"""
+        return {'driver_get': 0.0, 'ready': 0.0, 'switch': 0.0, 'floor': 0.0}
+
+    def _load_page(self, url):
+        """ページに遷移して準備完了まで待機し、遷移開始時刻を返す"""
+        self.page_waits = self._new_page_waits()
+        with self.scheduler.permit(url):
+            started = time.monotonic()
+            with span('driver_get'):
+                self.driver.get(url)
+            loaded = time.monotonic()
+            with span('wait_ready'):
+                self._wait_until_ready()
+        self.page_waits['driver_get'] = loaded - started
+        self.page_waits['ready'] = time.monotonic() - loaded
+        return started
+
+    def _apply_wait_floor(self, started):
+        """最低待機時間に満たない場合のみ残りを待機"""
+        floor_sleep = max(0.0, PAGE_MIN_WAIT - (time.monotonic() - started))
+        if floor_sleep:
+            with span('wait_floor'):
+                time.sleep(floor_sleep)
+        self.page_waits['floor'] = floor_sleep
+
+    def _snapshot_regions(self):
+        """詳細ボックスと価格リストのHTMLだけを取得（page_sourceより軽量）"""
+        fragments = self.driver.execute_script(
+            "return arguments[0].map(function(id) {"
+            "  var el = document.getElementById(id);"
+            "  return el ? el.outerHTML : '';"
+            "});",
+            list(DETAIL_REGION_IDS)
+        )
+        return '<html><body>' + '\n'.join(fragments) + '</body></html>'
+
+    def _wait_until_ready(self):
+        """詳細ボックスや商品一覧など、ページ固有の要素が現れるまで待機"""
+        try:
+            WebDriverWait(self.driver, PAGE_READY_TIMEOUT, poll_frequency=WAIT_POLL_FREQUENCY).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, PAGE_READY_SELECTOR))
+            )
+        except TimeoutException:
+            logging.warning(f"ページの準備完了を検出できませんでした: {PAGE_READY_SELECTOR}")
+
+    def _get_price_list_state(self):
+        """価格リスト先頭要素のonclick属性を取得（DOM全体をシリアライズしない）"""
+        return self.driver.execute_script(
+            "var el = document.querySelector('#small_price_list li[id^=\"small_price\"]');"
+            "return el ? el.getAttribute('onclick') : null;"
+        )
+
+    def _switch_unit(self, unit):
+        """単位タブを切り替え、価格リストが切り替わるまで待機"""
+        unit_buttons = self.driver.find_elements(By.ID, f"unit_{unit}")
+        if not unit_buttons:
+            logging.debug(f"unit_{unit} ボタンが存在しないためスキップします")
+            return False
+        
+        before = self._get_price_list_state()
+        expected = f"change_volume({unit},"
+        
+        # JavaScriptを使用してクリックを実行
+        clicked = time.monotonic()
+        self.driver.execute_script("arguments[0].click();", unit_buttons[0])
+        
+        def price_list_switched(driver):
+            state = self._get_price_list_state()
+            return bool(state) and (state != before or state.startswith(expected))
+        
+        try:
+            WebDriverWait(self.driver, UNIT_SWITCH_TIMEOUT, poll_frequency=WAIT_POLL_FREQUENCY).until(price_list_switched)
+            return True
+        except TimeoutException:
+            logging.warning(f"unit_{unit} への価格リストの切り替えを検出できませんでした")
+            return False
+        finally:
+            self.page_waits['switch'] += time.monotonic() - clicked
+
+    def _record_wait(self, url):
+        """ページごとの待機時間（準備完了待ち＋単位切り替え待ち＋最低待機）と、従来の固定待機と比べて短縮できた時間を記録"""
+        waited = self.page_waits['ready'] + self.page_waits['switch'] + self.page_waits['floor']
+        saved = LEGACY_PAGE_SLEEP - waited
+        self.wait_stats['pages'] += 1
+        self.wait_stats['wait_seconds'] += waited
+        self.wait_stats['saved_seconds'] += saved
+        logging.debug(f"ページ準備完了: {waited:.2f}秒 (固定待機比 {saved:.2f}秒短縮) {url}")
+
+    def get_wait_stats(self):
+        """待機時間の計測結果（1ページあたりの平均を含む）を取得"""
+        pages = self.wait_stats['pages']
+        return {
+            **self.wait_stats,
+            'avg_wait_seconds': self.wait_stats['wait_seconds'] / pages if pages else 0.0,
+            'avg_saved_seconds': self.wait_stats['saved_seconds'] / pages if pages else 0.0,
+        }
+
+    def restart_driver(self):
+        """ドライバーを破棄して再初期化"""
+        self._quit_driver()
+        self._init_driver()
+
+    def _quit_driver(self):
+        """ドライバーを閉じる"""
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logging.warning(f"ドライバーの終了中にエラー: {str(e)}")
+            self.driver = None
+        self._release_driver_proxy()
+
+    def close(self):
+        """ドライバーとHTTPセッションを閉じる"""
+        if getattr(self, 'http_fetcher', None):
+            self.http_fetcher.close()
+        self._quit_driver()
 
     def __del__(self):
         """デストラクタでドライバーを閉じる"""
-        if self.driver:
-            self.driver.quit()
+        self.close()
 
     def _extract_size_from_url(self, url):
         """URLからサイズ情報を抽出"""
@@ -136,8 +421,18 @@ class Scraper:
             logging.error(f"サイズ情報の抽出中にエラー: {str(e)}")
             return None
     
-    def get_product_ids(self, size=None):
-        """指定されたサイズの商品IDを取得してデータベースに保存"""
+    def get_product_ids(self, size=None, size_workers=CATEGORY_SIZE_WORKERS):
+        """指定されたサイズの商品IDを取得してデータベースに保存（取得した商品のリストを返す）"""
+        all_product_ids = []
+        for _, products in self.iter_product_ids(size, size_workers):
+            all_product_ids.extend(products)
+        return all_product_ids
+
+    def iter_product_ids(self, size=None, size_workers=CATEGORY_SIZE_WORKERS):
+        """サイズごとに並行して商品IDを取得し、1ページ分を保存するたびに (サイズ, 商品リスト) を返す
+
+        取得に失敗したサイズがあった場合は、全サイズの処理が終わった後に最初のエラーを送出する。
+        """
         if size is None:
             sizes = SIZES
         else:
@@ -145,368 +440,299 @@ class Scraper:
 
         logging.info(f"取得対象のサイズ: {sizes}")
 
-        all_product_ids = []
-        page = 1
-        for size_type in sizes:
-            category_url = f"{self.category_base_url}{size_type}/"
-            logging.info(f"処理中のURL: {category_url}")
-
-            product_ids = []
-            
-            has_next_page = True
-            processed_urls = set()  # 処理済みURLを記録
+        # 各サイズのワーカーが保存済みのページを渡すキュー（Noneはそのサイズの終了、例外はそのサイズの失敗）
+        page_queue = queue.Queue()
 
+        def crawl(size_type):
             try:
-                while has_next_page:
-                    url = f"{category_url}?page={page}"
-                    
-                    # 既に処理済みのURLの場合はスキップ
-                    if url in processed_urls:
-                        logging.warning(f"URLが既に処理済みです: {url}")
-                        has_next_page = False
-                        break
-                    
-                    processed_urls.add(url)
-                    logging.info(f"ページ {page} の処理を開始...")
-                    
-                    # リクエスト前に待機
-                    sleep_time = random.uniform(2, 5)
-                    logging.info(f"待機時間: {sleep_time:.2f}秒")
-                    time.sleep(sleep_time)
-                    
-                    # リクエスト実行
-                    logging.info("リクエスト送信中...")
-                    response = self.make_request(url)
-                    
-                    if not response:
-                        logging.error("リクエストが失敗しました")
-                        has_next_page = False
-                        break
-                    
-                    # エンコーディングを修正
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # 商品ボックスの検索
-                    result_box = soup.find('div', id='resultBox')
-                    if not result_box:
-                        logging.warning(f"ページ {page} で商品が見つかりません")
-                        has_next_page = False
-                        break
-                    
-                    product_boxes = result_box.find_all('div', class_='product_box')
-                    
-                    # 商品情報の取得
-                    for box in product_boxes:
-                        try:
-                            product_name = box.find('h4')
-                            product_name = product_name.text.strip() if product_name else ""
-
-                            
-                            product_id_element = box.find('li', class_='product_id')
-                            if product_id_element:
-                                product_id = product_id_element.get('id')
-                                if product_id:
-                                    # 既に取得済みの商品IDはスキップ
-                                    if any(p['id'] == product_id for p in product_ids):
-                                        logging.info(f"商品ID {product_id} は既に取得済みです")
-                                        continue
-
-                                    product_url_tag = box.find('a')
-                                    relative_url = product_url_tag['href'] if product_url_tag and product_url_tag.has_attr('href') else None
-                                    full_url = urljoin(BASE_URL, relative_url) if relative_url else None
-                                    
-                                    product_data = {
-                                        'id': product_id,
-                                        'name': product_name,
-                                        'url': full_url
-                                    }
-                                    product_ids.append(product_data)
-                                    logging.info(f"商品IDを取得: {product_id} - {product_name}")
-                        except Exception as e:
-                            logging.error(f"商品情報の取得中にエラー: {str(e)}")
-                            continue
-
-                    # 次のページの確認
-                    next_page_link = soup.find('li', class_='next_page')
-                    if not next_page_link:
-                        logging.info("次のページが見つかりません。ページネーション終了")
-                        has_next_page = False
-
-                        # 商品IDをデータベースに保存
-                        if product_ids:
-                            self.db.save_product_ids(product_ids, size_type)
-                            all_product_ids.extend(product_ids)
-                            logging.info(f"サイズ {size_type} の商品ID {len(product_ids)} 件を保存しました")
-                        else:
-                            logging.warning(f"サイズ {size_type} の商品が見つかりませんでした")
-                            has_next_page = False
-                    else:
-                        page += 1
-                        logging.info(f"次のページに移動します: {page}")
-                    
+                for products in self._iter_size_product_ids(size_type):
+                    page_queue.put((size_type, products))
             except Exception as e:
                 logging.error(f"サイズ {size_type} の処理中にエラーが発生: {str(e)}")
-                continue
+                page_queue.put((size_type, e))
+            finally:
+                page_queue.put((size_type, None))
 
-        return all_product_ids
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(len(sizes), size_workers))) as executor:
+            for size_type in sizes:
+                executor.submit(crawl, size_type)
+            remaining = len(sizes)
+            while remaining:
+                size_type, products = page_queue.get()
+                if products is None:
+                    remaining -= 1
+                    continue
+                if isinstance(products, Exception):
+                    errors.append(products)
+                    continue
+                yield size_type, products
+        if errors:
+            raise errors[0]
 
-    def _get_numeric(self, soup, label):
-        """数値データを取得"""
-        logging.info(f"数値データの取得を開始: {label}")
-        details_box = soup.find('div', id='detailsBox')
-        if not details_box:
-            logging.warning("detailsBoxが見つかりませんでした")
-            return None
+    def _iter_size_product_ids(self, size_type):
+        """1サイズ分の商品IDをページ単位で保存して返す（2ページ目以降はページ数を読み取って並行取得）"""
+        category_url = f"{self.category_base_url}{size_type}/"
+        logging.info(f"処理中のURL: {category_url}")
 
-        # 「外寸法」や「内寸法」から分割して取得
-        if label in ["長さ (外寸)", "幅 (外寸)", "深さ (外寸)"]:
-            for dt in details_box.find_all('dt'):
-                dt_text = dt.get_text(strip=True)
-                if "外寸法" in dt_text:
-                    dd = dt.find_next_sibling('dd')
-                    if not dd:
-                        logging.warning(f"外寸法 のdd要素が見つかりませんでした")
-                        return None
-                    text = dd.get_text(strip=True)
-                    # 例: 276×198×28(深さ) mm
-                    m = re.match(r'([\d\.]+)×([\d\.]+)×([\d\.]+)', text)
-                    if m:
-                        if label == "長さ (外寸)":
-                            return float(m.group(1))
-                        elif label == "幅 (外寸)":
-                            return float(m.group(2))
-                        elif label == "深さ (外寸)":
-                            return float(m.group(3))
-                    else:
-                        logging.warning(f"外寸法の数値抽出に失敗: {text}")
-                        return None
-
-        # 「内寸法」も同様
-        if label in ["長さ (内寸)", "幅 (内寸)", "深さ (内寸)"]:
-            for dt in details_box.find_all('dt'):
-                dt_text = dt.get_text(strip=True)
-                if "内寸法" in dt_text:
-                    dd = dt.find_next_sibling('dd')
-                    if not dd:
-                        logging.warning(f"内寸法 のdd要素が見つかりませんでした")
-                        return None
-                    text = dd.get_text(strip=True)
-                    # 例: 305×220×25(深さ) mm
-                    m = re.match(r'([\d\.]+)×([\d\.]+)×([\d\.]+)', text)
-                    if m:
-                        if label == "長さ (内寸)":
-                            return float(m.group(1))
-                        elif label == "幅 (内寸)":
-                            return float(m.group(2))
-                        elif label == "深さ (内寸)":
-                            return float(m.group(3))
-                    else:
-                        logging.warning(f"内寸法の数値抽出に失敗: {text}")
-                        return None
-
-        # それ以外は従来通り
-        for dt in details_box.find_all('dt'):
-            dt_text = dt.get_text(strip=True)
-            if label in dt_text:
-                dd = dt.find_next_sibling('dd')
-                if not dd:
-                    logging.warning(f"{label} のdd要素が見つかりませんでした")
-                    return None
-                a = dd.find('a')
-                text = a.get_text(strip=True) if a else dd.get_text(strip=True)
-                logging.debug(f"{label} の抽出テキスト: {text}")
-                m = re.search(r'([\d\.]+)', text)
-                if m:
-                    result = float(m.group(1))
-                    logging.info(f"{label} の取得結果: {result}")
-                    return result
-                else:
-                    logging.warning(f"{label} の数値抽出に失敗: {text}")
-                    return None
-        logging.warning(f"{label} のdt要素が見つかりませんでした")
-        return None
-
-    def _get_text(self, soup, label):
-        """テキストデータを取得"""
-        logging.info(f"テキストデータの取得を開始: {label}")
+        seen_ids = set()
+        saved_count = 0
+
+        def save_page(page, soup):
+            """ページ内の未取得の商品を保存して返す"""
+            nonlocal saved_count
+            products = []
+            for product_data in parse_listing_products(soup):
+                # 既に取得済みの商品IDはスキップ
+                if product_data['id'] in seen_ids:
+                    logging.debug(f"商品ID {product_data['id']} は既に取得済みです")
+                    continue
+                seen_ids.add(product_data['id'])
+                products.append(product_data)
+            if products:
+                counts = self.db.save_product_ids(products, size_type)
+                saved_count += len(products)
+                logging.info(f"サイズ {size_type} ページ {page} の商品ID {len(products)} 件を保存しました（新規: {counts['inserted']} 件, 更新: {counts['updated']} 件）")
+            return products
+
+        # 1ページ目の取得に失敗した場合はサイズ全体の失敗として扱う
+        first_soup = self._fetch_listing_page(category_url, 1, raise_errors=True)
+        if first_soup is None:
+            logging.warning(f"サイズ {size_type} の商品が見つかりませんでした")
+            return
+
+        last_page = self._get_known_last_page(first_soup, 1)
+        products = save_page(1, first_soup)
+        if products:
+            yield products
+        next_page = 2
+        with ThreadPoolExecutor(max_workers=CATEGORY_MAX_CONCURRENCY) as executor:
+            while next_page <= last_page:
+                batch = list(range(next_page, last_page + 1))
+                logging.info(f"サイズ {size_type}: ページ {batch[0]}〜{batch[-1]} を並行取得します")
+                for page, soup in zip(batch, executor.map(lambda p: self._fetch_listing_page(category_url, p), batch)):
+                    if soup is None:
+                        continue
+                    # ページ送りに表示されるページ番号が一部だけの場合は、取得したページから続きを読み取る
+                    last_page = max(last_page, self._get_known_last_page(soup, page))
+                    products = save_page(page, soup)
+                    if products:
+                        yield products
+                next_page = batch[-1] + 1
+
+        logging.info(f"サイズ {size_type} の商品ID {saved_count} 件を保存しました（{last_page} ページ）")
+
+    def _get_known_last_page(self, soup, page):
+        """ページ送りから分かる最終ページ番号（次のページがあれば少なくとも page + 1）"""
+        last_page = get_last_page_number(soup)
+        if soup.find('li', class_='next_page'):
+            last_page = max(last_page, page + 1)
+        return max(last_page, page)
+
+    def _fetch_listing_page(self, category_url, page, raise_errors=False):
+        """カテゴリページを1ページ取得して解析（商品一覧がなければNone、raise_errors=Trueならリクエストの失敗を送出）"""
+        url = f"{category_url}?page={page}"
+        logging.debug(f"ページ {page} の処理を開始: {url}")
         
-        details_box = soup.find('div', id='detailsBox')
-        if not details_box:
-            logging.warning("detailsBoxが見つかりませんでした")
+        # リクエストの間隔は共通のリクエスト制御で調整される
+        try:
+            response = self.make_request(url, required_marker='resultBox')
+        except Exception as e:
+            logging.error(f"リクエストが失敗しました: {url} ({str(e)})")
+            if raise_errors:
+                raise
             return None
-
-        # dt要素の内容をデバッグ出力
-        for dt in details_box.find_all('dt'):
-            dt_text = dt.get_text(strip=True)
-            logging.info(f"dt要素の内容: {dt_text}")
-            if label in dt_text:
-                dd = dt.find_next_sibling('dd')
-                if dd:
-                    # 材質の場合は特別な処理
-                    if label == '紙質（強度）':
-                        quality_span = dd.find('span', id='more_quality')
-                        if quality_span:
-                            text = quality_span.get_text(strip=True)
-                            logging.info(f"{label} の取得結果: {text}")
-                            return text
-                        else:
-                            logging.warning(f"{label} のspan要素が見つかりませんでした")
-                            return None
-                    else:
-                        text = dd.get_text(strip=True)
-                        logging.info(f"{label} の取得結果: {text}")
-                        return text
-                else:
-                    logging.warning(f"{label} のdd要素が見つかりませんでした")
-                    return None
         
-        logging.warning(f"{label} の要素が見つかりませんでした")
-        return None
+        # 商品一覧とページ送りの部分だけを解析
+        soup = parse_listing_page(response.text)
+        if not soup.find('div', id='resultBox'):
+            logging.warning(f"ページ {page} で商品が見つかりません: {url}")
+            return None
+        return soup
+
+    def get_product_details(self, product_ids=None, workers=1, max_age_hours=DETAIL_MAX_AGE_HOURS):
+        """商品の詳細情報を取得してデータベースに保存
 
-    def get_product_details(self, product_ids=None):
-        """商品の詳細情報を取得してデータベースに保存"""
+        product_ids を省略した場合は、詳細が未取得または max_age_hours 以上更新されていない商品だけを取得する。
+        取得済みの商品は保存時に詳細取得日時が記録されるため、中断後に再実行すると残りの商品から再開される。
+        """
         if product_ids is None:
-            product_ids = self.db.get_all_product_ids()
-        
+            product_ids = self.db.get_products_needing_refresh(max_age_hours)
+
+        # 複数ワーカーが指定された場合はドライバープールで並列取得（replayモードはブラウザを使わないため不要）
+        if workers and workers > 1 and not self.replay:
+            with ScraperPool(workers) as pool:
+                return [data for _, data, _ in pool.iter_product_details(product_ids) if data]
+
         logging.info(f"取得対象の商品数: {len(product_ids)}")
         all_data = []  # 全商品のデータを格納するリスト
         
         for product_id in product_ids:
             try:
-                urls = self.db.get_url_by_product_id(product_id)
-                if not urls:
-                    logging.error(f"商品ID {product_id} のURLが見つかりません")
-                    continue
-                    
-                url = urls[0]['url']
-                logging.info(f"商品詳細の取得を開始: {url}")
-                
-                # 1枚単位の価格を取得
-                max_retries = 3  # 最大再試行回数
-                for attempt in range(max_retries):
-                    response = self.make_request(url, unit=1)
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # タブが正しく切り替わっているか確認
-                    price_element = soup.find('li', id='small_price1')
-                    if price_element and 'onclick' in price_element.attrs:
-                        onclick_text = price_element['onclick']
-                        if 'change_volume(1,' in onclick_text:
-                            break
-                        else:
-                            logging.warning(f"1枚表示の価格要素が見つかりません。再試行 {attempt + 1}/{max_retries}")
-                    else:
-                        logging.warning(f"価格要素が見つかりません。再試行 {attempt + 1}/{max_retries}")
-                    if attempt < max_retries - 1:
-                        time.sleep(2)  # 再試行前に少し待機
-                    else:
-                        logging.error("1枚表示の価格要素を取得できませんでした。")
-                        continue
-                
-                # 商品データの取得
-                data = {
-                    '商品コード': product_id,  # データベースのカラム名に合わせて変更
-                    '商品名': self._get_text(soup, '商品名'),
-                    'サイズ': self.db.get_size_type(product_id),
-                    'url': url,
-                    '外形_三辺合計': self._get_numeric(soup, '3辺外寸合計'),
-                    '長さ_内寸': self._get_numeric(soup, '長さ (内寸)'),
-                    '幅_内寸': self._get_numeric(soup, '幅 (内寸)'),
-                    '深さ_内寸': self._get_numeric(soup, '深さ (内寸)'),
-                    '製法': self._get_text(soup, 'フルート'),
-                    '長さ_外寸': self._get_numeric(soup, '長さ (外寸)'),
-                    '幅_外寸': self._get_numeric(soup, '幅 (外寸)'),
-                    '深さ_外寸': self._get_numeric(soup, '深さ (外寸)'),
-                    '色': self._get_text(soup, '表面色'),
-                    '形式': self._get_text(soup, '箱形式'),
-                    '厚み': self._get_numeric(soup, '厚さ'),
-                    '材質': self._get_text(soup, '紙質（強度）'),
-                }
-                
-                # 1枚単位の価格情報を取得
-                price_list = soup.find('ul', id='small_price_list')
-                if price_list:
-                    MAX_ITERATIONS = 120
-                    i = 1
-                    while i <= MAX_ITERATIONS:
-                        price_element = soup.find('li', id=f'small_price{i}')
-                        if not price_element:
-                            break
-                            
-                        onclick_text = price_element.get('onclick', '')
-                        match = re.search(r'change_volume\((\d+),\s*(\d+),', onclick_text)
-                        if match:
-                            quantity = int(match.group(1))
-                            price = int(match.group(2))
-                            data[f'{quantity}枚の価格'] = price  # データベースのカラム名に合わせて変更
-                            logging.info(f"{quantity}枚の価格を取得: {price}円")
-                            i += 1
-                        else:
-                            break
-                
-                # 10枚単位の価格を取得
-                response = self.make_request(url, unit=10)
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                price_list = soup.find('ul', id='small_price_list')
-                if price_list:
-                    MAX_ITERATIONS = 120
-                    i = 1
-                    while i <= MAX_ITERATIONS:
-                        price_element = soup.find('li', id=f'small_price{i}')
-                        if not price_element:
-                            break
-                            
-                        onclick_text = price_element.get('onclick', '')
-                        match = re.search(r'change_volume\((\d+),\s*(\d+),', onclick_text)
-                        if match:
-                            quantity = int(match.group(1))
-                            price = int(match.group(2))
-                            data[f'{quantity}枚の価格'] = price  # データベースのカラム名に合わせて変更
-                            logging.info(f"{quantity}枚の価格を取得: {price}円")
-                            i += 1
-                        else:
-                            break
-                
-                # big_priceの価格を取得
-                big_price_list = soup.find('ul', id='big_price_list')
-                if big_price_list:
-                    MAX_ITERATIONS = 120
-                    i = 1
-                    while i <= MAX_ITERATIONS:
-                        big_price_element = soup.find('li', id=f'big_price{i}')
-                        if not big_price_element:
-                            break
-                        onclick_text = big_price_element.get('onclick', '')
-                        match = re.search(r'change_volume\((\d+),\s*(\d+),', onclick_text)
-                        if match:
-                            quantity = int(match.group(1))
-                            price = int(match.group(2))
-                            data[f'{quantity}枚の価格'] = price  # データベースのカラム名に合わせて変更
-                            logging.info(f"{quantity}枚の価格を取得: {price}円")
-                            i += 1
-                        else:
-                            break
-                
-                # データベースに保存
-                self.db.save_product(data)
-                logging.info(f"商品データの取得完了: {product_id}")
-                
-                # 取得したデータをリストに追加
-                all_data.append(data)
-                
+                data = self.get_product_detail(product_id)
+                if data:
+                    # 取得したデータをリストに追加
+                    all_data.append(data)
             except Exception as e:
                 logging.error(f"商品 {product_id} の詳細取得中にエラー: {str(e)}")
                 continue
         
         return all_data  # 取得した全商品のデータを返す
 
+    def try_get_product_detail(self, product_id):
+        """1商品の詳細情報を取得し (商品ID, データ, エラー) を返す（失敗は例外にせず、ドライバーエラー時は再起動する）"""
+        try:
+            return product_id, self.get_product_detail(product_id), None
+        except WebDriverException as e:
+            # ドライバーが壊れた可能性があるため再起動して次の商品に備える
+            logging.error(f"商品 {product_id} の取得中にドライバーエラー: {str(e)}")
+            try:
+                self.restart_driver()
+            except Exception as restart_error:
+                logging.error(f"ドライバーの再起動に失敗: {str(restart_error)}")
+            return product_id, None, str(e)
+        except Exception as e:
+            logging.error(f"商品 {product_id} の詳細取得中にエラー: {str(e)}")
+            return product_id, None, str(e)
+
+    def get_product_detail(self, product_id):
+        """1商品の詳細情報を取得してデータベースに保存（処理段階ごとの所要時間も記録）"""
+        with trace_product(product_id, self.db):
+            return self._get_product_detail(product_id)
+
+    def _get_product_detail(self, product_id):
+        """1商品の詳細情報を取得してデータベースに保存"""
+        with span('db_lookup'):
+            urls = self.db.get_url_by_product_id(product_id)
+        if not urls:
+            logging.error(f"商品ID {product_id} のURLが見つかりません")
+            return None
+            
+        url = urls[0]['url']
+        logging.debug(f"商品詳細の取得を開始: {url}")
+        
+        if SINGLE_SESSION_UNITS:
+            # 1回のページ遷移で1枚単位・10枚単位の両方を取得
+            snapshots = self.fetch_unit_snapshots(url, units=(1, 10))
+            with span('parse_html'):
+                soup = parse_detail_page(snapshots[1])
+                unit10_soup = parse_detail_page(snapshots[10])
+            if not self._is_unit1_price_list(soup):
+                logging.warning("1枚表示の価格要素が見つかりません。")
+        else:
+            soup = self._fetch_unit1_page(url)
+            # 10枚単位の価格を取得
+            unit10_soup = parse_detail_page(self.make_request(url, unit=10).text)
+        
+        # 詳細ボックスと価格リストから商品データを作成
+        with span('db_lookup'):
+            size = self.db.get_size_type(product_id)
+        with span('extract'):
+            data = extract_product_data(product_id, url, size, soup, unit10_soup)
+        
+        # データベースに保存
+        with span('db_save'):
+            self.db.save_product(data)
+        logging.debug(f"商品データの取得完了: {product_id}")
+        
+        return data
+
+    def _is_unit1_price_list(self, soup):
+        """価格リストが1枚単位の表示になっているか確認"""
+        price_element = soup.find('li', id='small_price1')
+        return bool(price_element) and 'change_volume(1,' in price_element.get('onclick', '')
+
+    def _fetch_unit1_page(self, url):
+        """1枚単位の価格ページを取得（タブが切り替わるまで再読み込み）"""
+        max_retries = 3  # 最大再試行回数
+        for attempt in range(max_retries):
+            response = self.make_request(url, unit=1)
+            soup = parse_detail_page(response.text)
+            
+            # タブが正しく切り替わっているか確認
+            if self._is_unit1_price_list(soup):
+                break
+            logging.warning(f"1枚表示の価格要素が見つかりません。再試行 {attempt + 1}/{max_retries}")
+            if attempt == max_retries - 1:
+                logging.error("1枚表示の価格要素を取得できませんでした。")
+        return soup
+
+
+class ScraperPool:
+    """複数のSeleniumドライバーで商品詳細を並列取得するワーカープール"""
+
+    def __init__(self, workers=DETAIL_WORKERS):
+        self.workers = max(1, int(workers))
+        # ワーカーごと（他のジョブや画面のドライバーとも）に別のプロキシが割り当たるよう、ProxyManagerを共有する
+        self.proxy_manager = get_proxy_manager()
+        self._scrapers = queue.Queue()
+        self._all_scrapers = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _acquire(self):
+        """空いているScraperを取得（不足していれば新規作成）"""
+        try:
+            return self._scrapers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all_scrapers) < self.workers:
+                scraper = Scraper(self.proxy_manager)
+                self._all_scrapers.append(scraper)
+                logging.info(f"ワーカー用ドライバーを起動しました ({len(self._all_scrapers)}/{self.workers})")
+                return scraper
+        return self._scrapers.get()
+
+    def _release(self, scraper):
+        """Scraperをプールに返却"""
+        self._scrapers.put(scraper)
+
+    def _process(self, product_id):
+        """1商品を処理（失敗はこのワーカー内で閉じ込める）"""
+        scraper = self._acquire()
+        try:
+            return scraper.try_get_product_detail(product_id)
+        finally:
+            self._release(scraper)
+
+    def iter_product_details(self, product_ids):
+        """商品詳細を並列取得し、完了した順に (商品ID, データ, エラー) を返す"""
+        product_ids = [str(product_id) for product_id in product_ids]
+        logging.info(f"取得対象の商品数: {len(product_ids)} (ワーカー数: {self.workers})")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._process, product_id) for product_id in product_ids]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def close(self):
+        """全ワーカーのドライバーを閉じる"""
+        with self._lock:
+            for scraper in self._all_scrapers:
+                scraper.close()
+            self._all_scrapers = []
+        self._scrapers = queue.Queue()
+
+
 def main():
-    """メイン処理"""
+    """メイン処理（--replay を指定するとキャッシュ済みのページから全商品を解析し直す）"""
+    setup_logging()
     try:
+        if '--replay' in sys.argv[1:]:
+            scraper = Scraper(replay=True)
+            product_ids = [product['product_id'] for product in scraper.db.get_product_ids()]
+            started = time.monotonic()
+            product_info = scraper.get_product_details(product_ids)
+            print(f"キャッシュから {len(product_info)}/{len(product_ids)} 件の商品を解析しました（{time.monotonic() - started:.2f}秒）")
+            return
         scraper = Scraper()
         product_id = "12345"
-        product_info = scraper.get_product_details(product_id)
+        product_info = scraper.get_product_details([product_id], workers=DETAIL_WORKERS)
         if product_info:
             print("商品情報を取得しました:", product_info)
     except Exception as e:
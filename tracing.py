@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from config import TRACE_ENABLED
+
+# 商品ごとの処理時間を記録するトレース（スレッドごとに1件）
+_local = threading.local()
+
+
+class Trace:
+    """1商品の処理に含まれる各段階（span）の所要時間"""
+
+    def __init__(self, product_id):
+        self.trace_id = uuid.uuid4().hex
+        self.product_id = product_id
+        self.spans = []  # (段階名, 所要時間（秒）)
+
+    def add(self, stage, duration):
+        """段階の所要時間を追加"""
+        self.spans.append((stage, duration))
+
+
+def current_trace():
+    """このスレッドで記録中のトレースを取得（なければNone）"""
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace_product(product_id, db=None):
+    """1商品の処理をトレースし、終了時に各段階の所要時間をデータベースに保存"""
+    if not TRACE_ENABLED or current_trace() is not None:
+        yield None
+        return
+
+    trace = Trace(product_id)
+    _local.trace = trace
+    started = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.add('total', time.perf_counter() - started)
+        _local.trace = None
+        if db is not None:
+            try:
+                db.save_trace_spans(trace.trace_id, trace.product_id, trace.spans)
+            except Exception as e:
+                logging.warning(f"トレースの保存に失敗: {product_id} ({str(e)})")
+
+
+@contextmanager
+def span(stage):
+    """処理の段階の所要時間を記録（トレース中でなければ何もしない）"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.perf_counter() - started)